@@ -0,0 +1,59 @@
+""" Parsing benchmark.
+Compare the per-page CPU time of the available BeautifulSoup backends, parsing whole pages or only the articles
+container, as done by the reader.
+
+    $ python benchmarks/bench_parsing.py
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from bs4 import BeautifulSoup
+
+from core.parsing import PARSER, STRAINER_ARTICLES
+from core.skyblog_reader import _html_to_post
+from synthetic import generate_page
+
+
+def bench(pages: list[str], parser: str, parse_only) -> float:
+    """Return the mean time (in milliseconds) to parse a page and extract its posts"""
+    start = time.perf_counter()
+    for html in pages:
+        soup = BeautifulSoup(html, parser, parse_only=parse_only)
+        _html_to_post(soup)
+    return (time.perf_counter() - start) / len(pages) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=200, help="Number of pages")
+    args = parser.parse_args()
+
+    pages = [
+        generate_page(
+            username="bench",
+            page_number=i,
+            nb_pages=args.pages,
+            url_blog="https://bench.skyrock.com",
+            url_images="https://i.skyrock.net/bench",
+        )
+        for i in range(1, args.pages + 1)
+    ]
+
+    parsers = ["html.parser"]
+    if PARSER != "html.parser":
+        parsers.append(PARSER)
+
+    print(f"Default backend: {PARSER}")
+    print(f"{'backend':<12} {'parse':<10} {'ms/page':>8}")
+    for name in parsers:
+        for label, parse_only in (("full", None), ("targeted", STRAINER_ARTICLES)):
+            print(f"{name:<12} {label:<10} {bench(pages, name, parse_only):>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+""" End-to-end throughput benchmark.
+Start a local mock skyrock server, then measure the reader, the writer and the full archiving pipeline on its
+synthetic blogs. Reports pages/s, posts/s, MB/s and the peak RSS of the process after each stage.
+
+    $ python benchmarks/bench_pipeline.py --blogs 4 --pages 20 --latency 0.02
+"""
+
+import argparse
+import json
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from archiver import Archiver
+from core.asset_store import AssetStore
+from core.http_client import http_client
+from core.skyblog_reader import SkyblogReader
+from core.skyblog_writer import SkyblogWriter
+from core.utils import set_url_base
+from mock_server import MockSkyrockServer, make_blogs
+
+PATH_TEMPLATE = str(Path(__file__).parent.parent / "res" / "template")
+
+
+def get_peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def report(
+    stage: str, duration: float, nb_pages: int, nb_posts: int, nb_bytes: int
+) -> dict:
+    result = {
+        "stage": stage,
+        "duration": round(duration, 3),
+        "pages_per_s": round(nb_pages / duration, 1),
+        "posts_per_s": round(nb_posts / duration, 1),
+        "mb_per_s": round(nb_bytes / duration / 1e6, 2),
+        "peak_rss_mb": round(get_peak_rss_mb(), 1),
+    }
+    print(
+        f"{stage:<10} {result['duration']:>8.2f}s {result['pages_per_s']:>10.1f} pages/s "
+        f"{result['posts_per_s']:>10.1f} posts/s {result['mb_per_s']:>8.2f} MB/s "
+        f"{result['peak_rss_mb']:>8.1f} MB peak RSS"
+    )
+    return result
+
+
+def bench_reader(
+    usernames: list[str],
+    nb_workers: int,
+    nb_workers_parse: int,
+    archive_comments: bool = False,
+) -> tuple[dict, dict]:
+    readers = {}
+    with http_client.track() as stats:
+        start = time.perf_counter()
+        for username in usernames:
+            reader = SkyblogReader(
+                username=username,
+                nb_workers=nb_workers,
+                nb_workers_parse=nb_workers_parse,
+                archive_comments=archive_comments,
+                nb_workers_comments=nb_workers,
+            )
+            reader.get()
+            readers[username] = reader
+        duration = time.perf_counter() - start
+
+    nb_pages = sum(reader.max_page_number for reader in readers.values())
+    nb_posts = sum(len(reader.articles) for reader in readers.values())
+    return readers, report("reader", duration, nb_pages, nb_posts, stats.nb_bytes)
+
+
+def bench_writer(
+    readers: dict, path_dir_archives: str, nb_workers: int, nb_posts_per_page: int
+) -> dict:
+    store = AssetStore(path_dir_archives)
+    with http_client.track() as stats:
+        start = time.perf_counter()
+        nb_pages = 0
+        for username, reader in readers.items():
+            writer = SkyblogWriter(
+                username=username,
+                path_dir_archive_user=str(Path(path_dir_archives) / username),
+                path_template=PATH_TEMPLATE,
+                articles=reader.articles,
+                title=reader.title,
+                description=reader.description,
+                max_page_number=reader.max_page_number,
+                url_profile_picture=reader.url_profile_picture,
+                url_background=reader.url_background,
+                color_background=reader.color_background,
+                color_theme=reader.color_theme,
+                color_block_title=reader.color_block_title,
+                color_text_title=reader.color_text_title,
+                color_articles_background=reader.color_articles_background,
+                store=store,
+                nb_workers_assets=nb_workers,
+                nb_posts_per_page=nb_posts_per_page,
+            )
+            writer.archive()
+            nb_pages += -(-len(reader.articles) // nb_posts_per_page)
+        duration = time.perf_counter() - start
+
+    nb_posts = sum(len(reader.articles) for reader in readers.values())
+    return report("writer", duration, nb_pages, nb_posts, stats.nb_bytes)
+
+
+def bench_pipeline(
+    usernames: list[str],
+    nb_pages: int,
+    nb_posts: int,
+    path_dir_archives: str,
+    nb_workers: int,
+    nb_workers_parse: int,
+    nb_posts_per_page: int,
+    archive_comments: bool = False,
+) -> dict:
+    archiver = Archiver(
+        path_dir_archives=path_dir_archives,
+        path_template=PATH_TEMPLATE,
+        nb_workers_pages=nb_workers,
+        nb_workers_assets=nb_workers,
+        nb_workers_parse=nb_workers_parse,
+        nb_posts_per_page=nb_posts_per_page,
+        archive_comments=archive_comments,
+        nb_workers_comments=nb_workers,
+    )
+    archiver.start_process_pools()
+    with http_client.track() as stats:
+        start = time.perf_counter()
+        for username in usernames:
+            archiver.archive_user(username)
+        duration = time.perf_counter() - start
+    return report("pipeline", duration, nb_pages, nb_posts, stats.nb_bytes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--blogs", type=int, default=4, help="Number of blogs")
+    parser.add_argument("--pages", type=int, default=20, help="Pages per blog")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds per request")
+    parser.add_argument("--image-size", type=int, default=50_000, help="Bytes per image")
+    parser.add_argument("--workers", type=int, default=8, help="Workers per stage")
+    parser.add_argument(
+        "--parse-workers",
+        type=int,
+        default=0,
+        help="Processes parsing the pages (0 to parse in the fetching threads)",
+    )
+    parser.add_argument("--posts-per-page", type=int, default=5)
+    parser.add_argument(
+        "--comments", action="store_true", help="Also archive the comments of the posts"
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    blogs = make_blogs(args.blogs, args.pages)
+    usernames = [blog.username for blog in blogs]
+    server = MockSkyrockServer(
+        blogs=blogs, latency=args.latency, image_size=args.image_size
+    )
+    server.start()
+    set_url_base(server.url_base)
+    http_client.configure(
+        timeout=30,
+        max_retries=0,
+        backoff_factor=0,
+        max_concurrency_pages=args.workers,
+        max_concurrency_assets=args.workers,
+    )
+
+    path_dir_tmp = tempfile.mkdtemp(prefix="skyblog-bench-")
+    try:
+        readers, result_reader = bench_reader(
+            usernames, args.workers, args.parse_workers, args.comments
+        )
+        nb_pages = sum(reader.max_page_number for reader in readers.values())
+        nb_posts = sum(len(reader.articles) for reader in readers.values())
+        result_writer = bench_writer(
+            readers,
+            str(Path(path_dir_tmp) / "writer"),
+            args.workers,
+            args.posts_per_page,
+        )
+        del readers
+        result_pipeline = bench_pipeline(
+            usernames,
+            nb_pages,
+            nb_posts,
+            str(Path(path_dir_tmp) / "pipeline"),
+            args.workers,
+            args.parse_workers,
+            args.posts_per_page,
+            args.comments,
+        )
+    finally:
+        server.stop()
+        shutil.rmtree(path_dir_tmp, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(
+                {
+                    "parameters": vars(args),
+                    "results": [result_reader, result_writer, result_pipeline],
+                },
+                fp,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+""" Local mock skyrock server.
+Serve synthetic blogs (see `synthetic.py`) with an optional injected latency, so that the archiver can be run and
+benchmarked without hitting the real site. Blogs are served under http://<host>:<port>/<username>/, thus the
+archiver `url_base` must be set to http://<host>:<port>/{username}.
+
+    $ python benchmarks/mock_server.py --blogs 10 --pages 20 --latency 0.05
+"""
+
+import argparse
+import hashlib
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from synthetic import (
+    generate_css,
+    generate_page,
+    generate_photo_page,
+    generate_post_page,
+    get_post_id,
+)
+
+PATTERN_POST_PAGE = re.compile(r"(\d{5})(\d{2})-title\.html")
+
+
+class Blog(object):
+    """Description of a synthetic blog"""
+
+    def __init__(
+        self,
+        username: str,
+        nb_pages: int,
+        css_perso: bool = False,
+        images: bool = True,
+        nb_posts_per_page: int = 5,
+    ):
+        self.username = username
+        self.nb_pages = nb_pages
+        self.css_perso = css_perso
+        self.images = images
+        self.nb_posts_per_page = nb_posts_per_page
+
+
+class MockSkyrockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        blogs: list[Blog],
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        image_size: int = 50_000,
+        throttle_rate: float = 0.0,
+    ):
+        super().__init__((host, port), MockSkyrockHandler)
+        self.blogs = {blog.username: blog for blog in blogs}
+        self.latency = latency
+        self.image_size = image_size
+        # Share of the requests answered with a 429, as a throttling server would
+        self.throttle_rate = throttle_rate
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_port}"
+
+    @property
+    def url_base(self) -> str:
+        """Value of the archiver `url_base` pointing to this server"""
+        return self.url + "/{username}"
+
+    def start(self):
+        """Serve in a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class MockSkyrockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head: bool = False):
+        server: MockSkyrockServer = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        if server.throttle_rate and random.random() < server.throttle_rate:
+            return self._send(429, "text/html", b"<html>Too many requests</html>", head)
+
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        if parts[0] == "img" and len(parts) == 3:
+            return self._send(200, "image/jpeg", self._generate_image(parts[2]), head)
+
+        blog = server.blogs.get(parts[0])
+        if blog is None:
+            return self._send(404, "text/html", b"<html>Not found</html>", head)
+
+        url_blog = f"{server.url}/{blog.username}"
+        url_images = f"{server.url}/img/{blog.username}"
+        resource = parts[1] if len(parts) > 1 else "1.html"
+        if resource == "template.css":
+            return self._send(200, "text/css", generate_css().encode(), head)
+        if resource == "photo.html":
+            return self._send(200, "text/html", generate_photo_page(url_images).encode(), head)
+        if resource.endswith(".html") and resource[:-5].isdigit():
+            page_number = int(resource[:-5])
+            if 1 <= page_number <= blog.nb_pages:
+                html = generate_page(
+                    username=blog.username,
+                    page_number=page_number,
+                    nb_pages=blog.nb_pages,
+                    url_blog=url_blog,
+                    url_images=url_images,
+                    nb_posts=blog.nb_posts_per_page,
+                    css_perso=blog.css_perso,
+                    images=blog.images,
+                )
+                return self._send(200, "text/html; charset=utf-8", html.encode(), head)
+        if match := PATTERN_POST_PAGE.fullmatch(resource):
+            page_number, index = int(match[1]), int(match[2])
+            if 1 <= page_number <= blog.nb_pages and index < blog.nb_posts_per_page:
+                page_comments = int(parse_qs(url.query).get("page", ["1"])[0])
+                html = generate_post_page(
+                    url_blog, get_post_id(page_number, index), page_comments
+                )
+                return self._send(200, "text/html; charset=utf-8", html.encode(), head)
+        return self._send(404, "text/html", b"<html>Not found</html>", head)
+
+    def _generate_image(self, name: str) -> bytes:
+        # Deterministic, incompressible content
+        seed = hashlib.sha256(name.encode()).digest()
+        nb_blocks = self.server.image_size // len(seed) + 1
+        return b"".join(
+            hashlib.sha256(seed + i.to_bytes(4, "big")).digest() for i in range(nb_blocks)
+        )[: self.server.image_size]
+
+    def _send(self, status: int, content_type: str, body: bytes, head: bool):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep benchmarks output clean
+        pass
+
+
+def make_blogs(nb_blogs: int, nb_pages: int, images: bool = True) -> list[Blog]:
+    """Half of the blogs use a template CSS file, the other half a pasted CSS"""
+    return [
+        Blog(
+            username=f"blog{i}",
+            nb_pages=nb_pages,
+            css_perso=i % 2 == 1,
+            images=images,
+        )
+        for i in range(nb_blogs)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--blogs", type=int, default=10, help="Number of blogs")
+    parser.add_argument("--pages", type=int, default=20, help="Pages per blog")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds per request")
+    parser.add_argument("--image-size", type=int, default=50_000, help="Bytes per image")
+    parser.add_argument("--no-images", action="store_true")
+    parser.add_argument(
+        "--throttle-rate", type=float, default=0.0, help="Share of 429 responses"
+    )
+    args = parser.parse_args()
+
+    server = MockSkyrockServer(
+        blogs=make_blogs(args.blogs, args.pages, images=not args.no_images),
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        image_size=args.image_size,
+        throttle_rate=args.throttle_rate,
+    )
+    print(f"Serving {args.blogs} blog(s) (blog0 ... blog{args.blogs - 1})")
+    print(f"Set url_base = {server.url_base}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+""" Synthetic skyblog pages.
+Generate pages mimicking the structure of skyrock.com blogs, as read by `core.skyblog_reader`, to benchmark the
+archiver without hitting the real site.
+"""
+
+import random
+
+CSS_TEMPLATE = """
+.bloc_title {{ background: #{color_block_title}; color: #{color_text_title}; }}
+.bloc, .bloc_content {{ background: #{color_articles_background}; }}
+.consult, .consult_content {{ background: #{color_background}; }}
+.bloc-description {{ background: #{color_theme}; }}
+"""
+
+LOREM = (
+    "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore et dolore "
+    "magna aliqua. Ut enim ad minim veniam, quis nostrud exercitation ullamco laboris nisi ut aliquip ex ea commodo."
+)
+
+# Comments per page of a post, as on skyrock
+NB_COMMENTS_PER_PAGE = 10
+
+
+def generate_css() -> str:
+    return CSS_TEMPLATE.format(
+        color_block_title="336699",
+        color_text_title="ffffff",
+        color_articles_background="f5f5f5",
+        color_background="cccccc",
+        color_theme="663399",
+    )
+
+
+def generate_css_perso() -> str:
+    # The pasted CSS is expected on the second line of the style tag
+    return (
+        "\n.bloc_title{color:#336699}.bloc-description{background-color:#663399}"
+        "#linkPopup{color:#ffffff}#promos_ads{color:#000000;background-color:#f5f5f5}"
+        "body{background-color:#cccccc}\n"
+    )
+
+
+def get_post_id(page_number: int, index: int) -> str:
+    return f"{page_number:05d}{index:02d}"
+
+
+def get_nb_comments(post_id: str) -> int:
+    """Number of comments of a post, a third of the posts having none"""
+    rng = random.Random(f"comments-{post_id}")
+    return rng.choice((0, rng.randint(1, 5), rng.randint(1, 35)))
+
+
+def generate_post(
+    url_blog: str, url_images: str, page_number: int, index: int, image: bool
+) -> str:
+    post_id = get_post_id(page_number, index)
+    rng = random.Random(post_id)
+    paragraphs = "".join(f"<p>{LOREM}</p>" for _ in range(rng.randint(1, 6)))
+    html_image = ""
+    if image:
+        html_image = (
+            f'<div class="image-container"><img src="{url_images}/{post_id}.jpg" alt="" /></div>'
+        )
+    return (
+        f'<div id="a-{post_id}" class="bloc article">'
+        f'<h2 class="bloc_title"><a href="{url_blog}/{post_id}-title.html">Post {post_id}</a></h2>'
+        f"{html_image}"
+        f'<div class="text-image-container">{paragraphs}</div>'
+        f'<time itemprop="dateCreated">{1 + index % 28:02d}/{1 + page_number % 12:02d}/2010</time>'
+        f'<a class="comments" href="{url_blog}/{post_id}-title.html#comments">'
+        f"{get_nb_comments(post_id)} commentaire(s)</a>"
+        f"</div>"
+    )
+
+
+def generate_post_page(url_blog: str, post_id: str, page_number: int) -> str:
+    """Generate the HTML of the page of a post, with a page of its comments"""
+    nb_comments = get_nb_comments(post_id)
+    nb_pages = max(1, -(-nb_comments // NB_COMMENTS_PER_PAGE))
+    url_post = f"{url_blog}/{post_id}-title.html"
+    start = (page_number - 1) * NB_COMMENTS_PER_PAGE
+    comments = "".join(
+        f'<li class="comment" id="c-{post_id}-{i}">'
+        f'<a class="author" href="https://visitor{i}.skyrock.com">visitor{i}</a>'
+        f"<time>{1 + i % 28:02d}/01/2011</time>"
+        f'<div class="comment_text"><p>Comment {i}. {LOREM[: 40 + 7 * (i % 10)]}</p></div>'
+        f"</li>"
+        for i in range(start, min(nb_comments, start + NB_COMMENTS_PER_PAGE))
+    )
+    pagination = ""
+    if nb_pages > 1:
+        pages = "".join(
+            f'<li><a href="{url_post}?page={i}">{i}</a></li>' for i in range(1, nb_pages + 1)
+        )
+        pagination = f'<ul class="pagination">{pages}<li><a href="{url_post}?page=2">Next</a></li></ul>'
+    return (
+        "<!DOCTYPE html><html><head>"
+        f"<title>Post {post_id}</title>"
+        '<meta charset="utf-8" />'
+        "<script>var skyrock = {};</script>"
+        "</head><body>"
+        f'<div id="a-{post_id}" class="bloc article"><h2 class="bloc_title">Post {post_id}</h2>'
+        f'<div class="text-image-container"><p>{LOREM}</p></div></div>'
+        f'<div id="comments"><ul class="comments_list">{comments}</ul>{pagination}</div>'
+        "</body></html>"
+    )
+
+
+def generate_page(
+    username: str,
+    page_number: int,
+    nb_pages: int,
+    url_blog: str,
+    url_images: str,
+    nb_posts: int = 5,
+    css_perso: bool = False,
+    images: bool = True,
+) -> str:
+    """Generate the HTML of a blog page"""
+    if css_perso:
+        style = f'<style id="template_css_perso">{generate_css_perso()}</style>'
+    else:
+        style = f'<link id="template_css" rel="stylesheet" href="{url_blog}/template.css" />'
+
+    pagination = ""
+    if nb_pages > 1:
+        pages = "".join(
+            f'<li><a href="{url_blog}/{i}.html">{i}</a></li>'
+            for i in range(1, nb_pages + 1)
+        )
+        pagination = f'<ul class="pagination">{pages}<li><a href="{url_blog}/2.html">Next</a></li></ul>'
+
+    posts = "".join(
+        generate_post(url_blog, url_images, page_number, index, images)
+        for index in range(nb_posts)
+    )
+    # Padding mimicking the menus, widgets and scripts of a real page
+    widgets = "".join(
+        f'<li class="widget"><a href="{url_blog}/widget/{i}">Widget {i}</a><span>{LOREM[:80]}</span></li>'
+        for i in range(40)
+    )
+    return (
+        "<!DOCTYPE html><html><head>"
+        f"<title>{username}'s blog</title>"
+        '<meta charset="utf-8" />'
+        f"{style}"
+        "<script>var skyrock = {};</script>"
+        "</head>"
+        f'<body style="background: url({url_images}/background.jpg);">'
+        f'<div id="header"><h1 class="blogtitle">{username}\'s blog</h1>'
+        f'<p class="description">Description of {username}\'s blog</p>'
+        f'<img class="avatar" src="{url_images}/avatar.jpg" /></div>'
+        f'<ul id="menu">{widgets}</ul>'
+        f'<div id="articles_container">{posts}</div>'
+        f"{pagination}"
+        "</body></html>"
+    )
+
+
+def generate_photo_page(url_images: str) -> str:
+    return (
+        "<!DOCTYPE html><html><head><title>Photo</title></head><body>"
+        f'<img id="laphoto" src="{url_images}/profile.jpg" />'
+        "</body></html>"
+    )
@@ -0,0 +1,117 @@
+// Comments of a post are loaded from their JSON file the first time their section is opened
+// ("toggle" does not bubble, it is caught while capturing)
+document.addEventListener(
+  "toggle",
+  function (event) {
+    var section = event.target;
+    if (!section.matches || !section.matches("details.comments") || !section.open || section.dataset.loaded) {
+      return;
+    }
+    section.dataset.loaded = "true";
+    fetch(section.dataset.src)
+      .then(function (response) {
+        if (!response.ok) {
+          throw new Error(response.statusText);
+        }
+        return response.json();
+      })
+      .then(function (comments) {
+        comments.forEach(function (comment) {
+          var item = document.createElement("div");
+          item.className = "comment";
+          var author = document.createElement("span");
+          author.className = "author";
+          author.textContent = comment.author;
+          var date = document.createElement("span");
+          date.className = "date";
+          date.textContent = comment.date;
+          // The text was sanitized when archived, with an allowlist of tags, attributes and URL schemes
+          var text = document.createElement("div");
+          text.className = "comment-text";
+          text.innerHTML = comment.text;
+          item.append(author, date, text);
+          section.appendChild(item);
+        });
+      })
+      .catch(function () {
+        delete section.dataset.loaded;
+        var error = document.createElement("p");
+        error.className = "comment";
+        error.textContent = "The comments could not be loaded.";
+        section.appendChild(error);
+      });
+  },
+  true
+);
+
+// Infinite scroll: once the end of the page gets close to the viewport, the next posts are appended from the JSON
+// shards of the archive, one shard at a time. Without the script (or the shards), the pagination links are kept.
+(function () {
+  var container = document.getElementById("posts");
+  if (!container || !container.dataset.shardSize || !("IntersectionObserver" in window)) {
+    return;
+  }
+  var shardSize = parseInt(container.dataset.shardSize, 10);
+  var nextPost = parseInt(container.dataset.nextPost, 10);
+  var pagination = container.querySelector(".pagination");
+  var sentinel = document.createElement("div");
+  var loading = false;
+
+  function stop() {
+    observer.disconnect();
+    sentinel.remove();
+  }
+
+  function loadNext() {
+    if (loading) {
+      return;
+    }
+    loading = true;
+    var shardNumber = Math.floor(nextPost / shardSize);
+    fetch("posts/" + shardNumber + ".json")
+      .then(function (response) {
+        if (!response.ok) {
+          throw new Error(response.statusText);
+        }
+        return response.json();
+      })
+      .then(function (shard) {
+        // The shard can start before the next post, with the last posts of the current page
+        shard.posts.slice(nextPost - shardNumber * shardSize).forEach(function (postHtml) {
+          sentinel.insertAdjacentHTML("beforebegin", postHtml);
+        });
+        nextPost = (shardNumber + 1) * shardSize;
+        loading = false;
+        if (!shard.has_next) {
+          stop();
+          return;
+        }
+        // Observe again, to load the next shard if the end of the page is still visible
+        observer.unobserve(sentinel);
+        observer.observe(sentinel);
+      })
+      .catch(function () {
+        // Fall back to the pagination links
+        stop();
+        if (pagination) {
+          pagination.style.display = "";
+        }
+      });
+  }
+
+  var observer = new IntersectionObserver(
+    function (entries) {
+      if (entries[0].isIntersecting) {
+        loadNext();
+      }
+    },
+    { rootMargin: "0px 0px 800px 0px" }
+  );
+  if (pagination) {
+    pagination.style.display = "none";
+    container.insertBefore(sentinel, pagination);
+  } else {
+    container.appendChild(sentinel);
+  }
+  observer.observe(sentinel);
+})();
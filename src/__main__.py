@@ -1,19 +1,67 @@
+import argparse
 import configparser
 import os
+from collections.abc import Iterator
 from pathlib import Path
 
 from archiver import Archiver
-from common import is_url
+from common import parse_username
+from core.http_client import http_client
+from core.page_cache import PageCache
+from core.thumbnails import Thumbnailer
+from core.utils import set_url_base
 from logger import logger
+from scheduler import Scheduler
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Archive skyrock.com blogs.")
+    parser.add_argument(
+        "--replay",
+        action="store_true",
+        help="Archive again from the page cache only, without any network access",
+    )
+    args = parser.parse_args()
+
     path_dir_root = Path(__file__).parent.parent
 
     # Load configuration file
     config = configparser.ConfigParser()
     config.read(path_dir_root / "config.ini")
 
+    http_client.configure(
+        timeout=config["network"].getfloat("timeout"),
+        max_retries=config["network"].getint("max_retries"),
+        backoff_factor=config["network"].getfloat("backoff_factor"),
+        max_concurrency_pages=config["network"].getint("max_concurrency_pages"),
+        max_concurrency_assets=config["network"].getint("max_concurrency_assets"),
+        rate_pages=config["network"].getfloat("rate_pages"),
+        rate_assets=config["network"].getfloat("rate_assets"),
+        burst=config["network"].getint("burst"),
+        latency_target=config["network"].getfloat("latency_target"),
+    )
+    set_url_base(config["network"]["url_base"])
+    if config["cache"].getboolean("enabled") or args.replay:
+        http_client.set_cache(
+            PageCache(
+                os.path.join(path_dir_root, config["cache"]["path_file_page_cache"])
+            ),
+            replay=args.replay,
+        )
+
+    thumbnailer = None
+    if config["thumbnails"].getboolean("enabled"):
+        thumbnailer = Thumbnailer(
+            widths=[
+                int(width) for width in config["thumbnails"]["widths"].split(",")
+            ],
+            webp=config["thumbnails"].getboolean("webp"),
+            nb_workers=config["thumbnails"].getint("nb_workers"),
+        )
+        if not thumbnailer.available:
+            logger.warning("Pillow is not installed, thumbnails are disabled")
+            thumbnailer = None
+
     archiver = Archiver(
         path_dir_archives=os.path.join(
             path_dir_root, config["path"]["path_dir_archives"]
@@ -22,28 +70,78 @@ def main():
             path_dir_root,
             config["path"]["path_template"],
         ),
+        nb_workers_pages=config["parameters"].getint("nb_workers_pages"),
+        nb_workers_assets=config["parameters"].getint("nb_workers_assets"),
+        nb_workers_parse=config["parameters"].getint("nb_workers_parse"),
+        nb_posts_per_page=config["output"].getint("nb_posts_per_page"),
+        nb_posts_per_shard=config["output"].getint("nb_posts_per_shard"),
+        prettify_posts=config["output"].getboolean("prettify_posts"),
+        minify=config["output"].getboolean("minify"),
+        precompress=config["output"].getboolean("precompress"),
+        container=config["output"].getboolean("container"),
+        thumbnailer=thumbnailer,
+        archive_comments=config["comments"].getboolean("enabled"),
+        nb_workers_comments=config["comments"].getint("nb_workers"),
+        # When replaying, previous archives are processed again from scratch
+        resume=not args.replay,
+        path_file_search_index=(
+            os.path.join(path_dir_root, config["search"]["path_file_search_index"])
+            if config["search"].getboolean("enabled")
+            else None
+        ),
     )
 
-    for username in iter_users(
-        path_file_list_users=os.path.join(
-            path_dir_root, config["parameters"]["path_file_list_users"]
+    scheduler = Scheduler(
+        archiver=archiver,
+        nb_workers=config["scheduler"].getint("nb_workers_users"),
+        executor=config["scheduler"]["executor"],
+        path_file_summary=os.path.join(
+            path_dir_root, config["path"]["path_file_summary"]
+        ),
+        path_file_report=os.path.join(path_dir_root, config["path"]["path_file_report"]),
+        path_dir_profiles=(
+            os.path.join(path_dir_root, config["profiling"]["path_dir_profiles"])
+            if config["profiling"].getboolean("cprofile")
+            else None
+        ),
+        trace_memory=config["profiling"].getboolean("tracemalloc"),
+        nb_workers_probe=config["scheduler"].getint("nb_workers_probe"),
+    )
+    scheduler.run(
+        iter_users(
+            path_file_list_users=os.path.join(
+                path_dir_root, config["parameters"]["path_file_list_users"]
+            )
         )
-    ):
-        logger.info(f'Archiving user "{username}"')
-        archiver.archive_user(username=username)
+    )
+    logger.info(f"Network: {http_client.stats}")
 
-    archiver.host_local()
+    archiver.host_local(
+        host=config["server"]["host"],
+        port=config["server"].getint("port"),
+        # The reports can be written in the archives directory
+        paths_hidden=(scheduler.path_file_summary, scheduler.path_file_report),
+    )
 
 
-def iter_users(path_file_list_users: str) -> str:
+def iter_users(path_file_list_users: str) -> Iterator[str]:
     """Iterate through a file containing one username per line.
-    Each line can be a valid skyblog URL or a valid skyblog-username.
+    Each line can be a valid skyblog URL or a valid skyblog-username. Usernames are normalized, and yielded once.
+    Empty lines and lines starting with "#" are ignored.
     """
+    usernames = set()
     with open(path_file_list_users) as fp:
-        for username in fp:
-            username = username.strip()
-            if is_url(username):
-                username = username.split("://")[1].split(".")[0]
+        for line in fp:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            username = parse_username(line)
+            if username is None:
+                logger.warning(f'Invalid user "{line}", skipping')
+                continue
+            if username in usernames:
+                continue
+            usernames.add(username)
             yield username
 
 
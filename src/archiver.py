@@ -1,13 +1,17 @@
-import functools
 import os.path
 import shutil
-from http.server import HTTPServer, SimpleHTTPRequestHandler
-
-import requests
 
 from logger import logger
+from core import metrics
+from core.asset_store import AssetStore
+from core.http_client import STATUS_RETRY, http_client
+from core.manifest import Manifest
+from core.search_index import SearchIndex
 from core.skyblog_reader import SkyblogReader
 from core.skyblog_writer import SkyblogWriter
+from core.thumbnails import Thumbnailer
+from core.utils import get_process_executor, get_url_page
+from server import ArchiveServer
 
 
 class Archiver(object):
@@ -15,35 +19,114 @@ class Archiver(object):
     This class will be used to archive a skyblog and make the link between the user input and the scrapper
     """
 
-    def __init__(self, path_dir_archives: str, path_template: str):
+    def __init__(
+        self,
+        path_dir_archives: str,
+        path_template: str,
+        nb_workers_pages: int = 1,
+        nb_workers_assets: int = 1,
+        nb_workers_parse: int = 0,
+        nb_posts_per_page: int = 5,
+        nb_posts_per_shard: int = 30,
+        prettify_posts: bool = False,
+        resume: bool = True,
+        path_file_search_index: str = None,
+        minify: bool = True,
+        precompress: bool = True,
+        thumbnailer: Thumbnailer = None,
+        archive_comments: bool = False,
+        nb_workers_comments: int = 1,
+        container: bool = False,
+    ):
         self.path_dir_archives = path_dir_archives
         self.path_template = path_template
-        self.posts = []
-        self._max_page_nb = 1
-        self._html_first_page = None
-        self._username = None
-        self._color_bloc_title = None
+        self.nb_workers_pages = nb_workers_pages
+        self.nb_workers_assets = nb_workers_assets
+        self.nb_workers_parse = nb_workers_parse
+        self.nb_posts_per_page = nb_posts_per_page
+        self.nb_posts_per_shard = nb_posts_per_shard
+        self.prettify_posts = prettify_posts
+        self.resume = resume
+        self.minify = minify
+        self.precompress = precompress
+        self.thumbnailer = thumbnailer
+        self.archive_comments = archive_comments
+        self.nb_workers_comments = nb_workers_comments
+        self.container = container
 
         # Init paths
         os.makedirs(self.path_dir_archives, exist_ok=True)
 
-    def archive_user(self, username: str):
+        # Pictures are stored once for all users
+        self.store = AssetStore(self.path_dir_archives)
+
+        # Posts of all users are indexed in a single full-text index
+        self.search_index = (
+            SearchIndex(path_file_search_index)
+            if path_file_search_index is not None
+            else None
+        )
+
+    def start_process_pools(self):
+        """Start the process pools parsing pages and creating thumbnails, shared by the users archived by threads of
+        this process. Call it from the main thread, before starting any other thread: forking a multi-threaded process
+        can deadlock the children. Not needed when users are archived by process workers, which work inline."""
+        if self.nb_workers_parse > 0:
+            get_process_executor("parse", self.nb_workers_parse)
+        if self.thumbnailer is not None and self.thumbnailer.available:
+            self.thumbnailer.get_executor()
+
+    def probe_user(self, username: str) -> tuple[bool, str | None]:
+        """Check whether a user exists, with a single request of its first page. Return whether it exists, and the
+        first page content, to hand to `archive_user`. Already archived users are not requested."""
+        if Manifest.is_complete(os.path.join(self.path_dir_archives, username)):
+            return True, None
+        html_first_page = self.fetch_first_page(username)
+        return html_first_page is not None, html_first_page
+
+    def archive_user(self, username: str, html_first_page: str = None) -> bool:
+        """Archive a user. Return False if the user does not exist.
+        The first page, if already fetched by `probe_user`, is not requested again.
+        The archiver holds no per-user state, thus it can be shared by concurrent workers.
+        """
         path_dir_archive_user = os.path.join(self.path_dir_archives, username)
 
-        if not self.check_user_exists(username):
-            logger.warning(f"User does not exists {username}")
-            return
+        if self.resume and Manifest.is_complete(path_dir_archive_user):
+            logger.info(f'User "{username}" already archived, skipping')
+            return True
+
+        # Resume from the manifest of a previous run, if any
+        manifest = Manifest(path_dir_archive_user)
+        if not self.resume:
+            manifest.reset()
+
+        if html_first_page is None:
+            # The first page also tells whether the user exists
+            html_first_page = self.fetch_first_page(username)
+            if html_first_page is None:
+                logger.warning(f"User does not exists {username}")
+                return False
 
         reader = SkyblogReader(
             username=username,
+            nb_workers=self.nb_workers_pages,
+            manifest=manifest,
+            prettify=self.prettify_posts,
+            html_first_page=html_first_page,
+            nb_workers_parse=self.nb_workers_parse,
+            archive_comments=self.archive_comments,
+            nb_workers_comments=self.nb_workers_comments,
         )
-        reader.get()
+
+        # Articles are streamed from the reader to the writer, page after page
+        with metrics.span("reader.metadata"):
+            reader.get_metadata()
 
         writer = SkyblogWriter(
             username=username,
             path_dir_archive_user=path_dir_archive_user,
             path_template=self.path_template,
-            articles=reader.articles,
+            articles=reader.iter_articles(),
             title=reader.title,
             description=reader.description,
             max_page_number=reader.max_page_number,
@@ -54,24 +137,51 @@ class Archiver(object):
             color_block_title=reader.color_block_title,
             color_text_title=reader.color_text_title,
             color_articles_background=reader.color_articles_background,
+            store=self.store,
+            manifest=manifest,
+            nb_workers_assets=self.nb_workers_assets,
+            nb_posts_per_page=self.nb_posts_per_page,
+            nb_posts_per_shard=self.nb_posts_per_shard,
+            search_index=self.search_index,
+            minify=self.minify,
+            precompress=self.precompress,
+            thumbnailer=self.thumbnailer,
+            container=self.container,
         )
-        writer.archive()
+        with metrics.span("writer.archive"):
+            writer.archive()
+        manifest.set_complete(True)
+        return True
 
-    def host_local(self):
-        """Host the archive on a local server"""
+    def host_local(
+        self, host: str = "localhost", port: int = 8000, paths_hidden: tuple = ()
+    ):
+        """Host the archive on a local server, serving many clients concurrently. Users packed into a container are
+        served from it, without extracting it. The internal files of the archives directory, and the `paths_hidden`
+        ones, are not served."""
 
-        handler = functools.partial(
-            SimpleHTTPRequestHandler, directory=self.path_dir_archives
-        )
-        with HTTPServer(("localhost", 8000), handler) as httpd:
-            logger.info(
-                f"Serving archives at http://{httpd.server_address[0]}:{httpd.server_port}"
-            )
+        with ArchiveServer(
+            self.path_dir_archives,
+            host=host,
+            port=port,
+            search_index=self.search_index,
+            paths_hidden=paths_hidden,
+        ) as httpd:
+            logger.info(f"Serving archives at {httpd.url}")
             try:
                 httpd.serve_forever()
             except KeyboardInterrupt:
                 pass
 
     @staticmethod
-    def check_user_exists(username: str) -> bool:
-        return requests.get(f"https://{username}.skyrock.com").status_code == 200
+    def fetch_first_page(username: str) -> str | None:
+        """Return the first page of a blog, or None if the user does not exist"""
+        with metrics.span("archiver.fetch_first_page"):
+            response = http_client.get(get_url_page(username, page_number=1))
+        if response.status_code in STATUS_RETRY:
+            # Still throttled after the retries, which does not tell whether the user exists
+            response.raise_for_status()
+        if response.status_code != 200:
+            return None
+        metrics.count("pages_fetched")
+        return response.text
@@ -1,6 +1,14 @@
 import datetime
+import hashlib
+import logging
 import os
-import requests
+import re
+import urllib.parse
+
+from core.http_client import KIND_ASSETS, http_client
+
+# The logger module depends on this one, thus its logger is retrieved by name
+logger = logging.getLogger("Skyblog-Archiving")
 
 
 def parse_path(path: str) -> str:
@@ -16,14 +24,54 @@ def is_url(string: str) -> bool:
     return string.startswith("https://") or string.startswith("http://")
 
 
-def save_picture(path_dir_output: str, url: str, filename: str = None):
+PATTERN_USERNAME = re.compile(r"^[a-z0-9][a-z0-9_-]*$")
+
+
+def parse_username(entry: str) -> str | None:
+    """Extract the username of a list entry: a skyblog URL (with or without scheme, "www." or path) or a username.
+    Usernames are case-insensitive, thus lowercased. Return None if the entry is not valid."""
+    entry = entry.strip()
+    if "." in entry or "/" in entry:
+        if not is_url(entry):
+            entry = "https://" + entry
+        hostname = urllib.parse.urlsplit(entry).hostname or ""
+        hostname = hostname.removeprefix("www.")
+        if not hostname.endswith(".skyrock.com"):
+            return None
+        entry = hostname.removesuffix(".skyrock.com")
+    username = entry.lower()
+    if not PATTERN_USERNAME.match(username):
+        return None
+    return username
+
+
+def save_picture(
+    path_dir_output: str, url: str, filename: str = None, chunk_size: int = 65536
+) -> str | None:
+    """Download a picture, streaming it to disk by chunks.
+    Return the SHA-256 hash of its content, or None if the download failed."""
     if filename is None:
         filename = url.split("/")[-1]
     path_file_output = os.path.join(path_dir_output, filename)
 
-    response = requests.get(url)
-    if response.status_code == 200:
-        with open(path_file_output, "wb") as file:
-            file.write(response.content)
-    else:
-        print(f"Failed to download image. Status code: {response.status_code}")
+    with http_client.get(url, kind=KIND_ASSETS, stream=True) as response:
+        if response.status_code != 200:
+            logger.warning(f'Failed to download picture "{url}": status code {response.status_code}')
+            return None
+
+        # Write to a temporary file first, so that an interrupted download never leaves a truncated picture
+        sha256 = hashlib.sha256()
+        path_file_tmp = path_file_output + ".part"
+        try:
+            with open(path_file_tmp, "wb") as file:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    file.write(chunk)
+                    sha256.update(chunk)
+                    http_client.add_bytes(len(chunk))
+            os.replace(path_file_tmp, path_file_output)
+        except BaseException:
+            # Never leave a partial download behind, e.g. when the connection breaks mid-stream
+            if os.path.exists(path_file_tmp):
+                os.remove(path_file_tmp)
+            raise
+    return sha256.hexdigest()
@@ -0,0 +1,84 @@
+import os
+import shutil
+import uuid
+
+from common import save_picture
+
+from core import database
+
+
+class AssetStore(object):
+    """
+    Content-addressed store of pictures, shared by all archived users.
+    Each picture is stored once under its SHA-256 hash, and linked (hardlink, or copy if the filesystem does not
+    support it) into the archives referencing it. A URL -> hash index ensures an already stored URL is never
+    downloaded again. The store can be shared by thread and process workers (see `database`).
+    """
+
+    DIRNAME = ".store"
+
+    def __init__(self, path_dir_archives: str):
+        self.path_dir = os.path.join(path_dir_archives, self.DIRNAME)
+        self.path_dir_objects = os.path.join(self.path_dir, "objects")
+        self.path_dir_tmp = os.path.join(self.path_dir, "tmp")
+        self.path_file_index = os.path.join(self.path_dir, "index.sqlite3")
+
+        os.makedirs(self.path_dir_objects, exist_ok=True)
+        os.makedirs(self.path_dir_tmp, exist_ok=True)
+        database.create(
+            self.path_file_index,
+            "CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, sha256 TEXT NOT NULL)",
+        )
+
+    def get_path_object(self, sha256: str) -> str:
+        return os.path.join(self.path_dir_objects, sha256[:2], sha256)
+
+    def get(self, url: str) -> str | None:
+        """Return the hash of an already stored URL, or None."""
+        with database.connect(self.path_file_index) as connection:
+            row = connection.execute(
+                "SELECT sha256 FROM urls WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None or not os.path.exists(self.get_path_object(row[0])):
+            return None
+        return row[0]
+
+    def fetch(self, url: str) -> str | None:
+        """Return the hash of a URL content, downloading and storing it if needed. Return None if the download
+        failed."""
+        sha256 = self.get(url)
+        if sha256 is not None:
+            return sha256
+
+        filename_tmp = uuid.uuid4().hex
+        sha256 = save_picture(
+            path_dir_output=self.path_dir_tmp, url=url, filename=filename_tmp
+        )
+        path_file_tmp = os.path.join(self.path_dir_tmp, filename_tmp)
+        if sha256 is None:
+            return None
+
+        path_object = self.get_path_object(sha256)
+        if os.path.exists(path_object):
+            # Same content already stored from another URL
+            os.remove(path_file_tmp)
+        else:
+            os.makedirs(os.path.dirname(path_object), exist_ok=True)
+            os.replace(path_file_tmp, path_object)
+
+        with database.connect(self.path_file_index) as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO urls (url, sha256) VALUES (?, ?)", (url, sha256)
+            )
+        return sha256
+
+    def link(self, sha256: str, path_file: str):
+        """Make a stored content available at the given path"""
+        os.makedirs(os.path.dirname(path_file), exist_ok=True)
+        if os.path.exists(path_file):
+            os.remove(path_file)
+        try:
+            os.link(self.get_path_object(sha256), path_file)
+        except OSError:
+            # Hardlinks not supported (or across filesystems), fallback to a copy
+            shutil.copyfile(self.get_path_object(sha256), path_file)
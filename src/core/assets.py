@@ -0,0 +1,91 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from logger import logger
+
+from core import metrics
+from core.asset_store import AssetStore
+from core.manifest import Manifest
+from core.utils import submit_in_context
+
+
+class AssetDownloader(object):
+    """
+    Asset stage of the writer.
+    Pictures URLs are collected (from the whole blog, or from a batch of posts), then downloaded concurrently, each
+    one streamed to disk.
+    URLs are deduplicated, and files already present (or recorded in the manifest) are not downloaded again.
+    Pictures go through the shared content-addressed store, and are linked from it into the user archive.
+    """
+
+    def __init__(
+        self,
+        path_dir_archive_user: str,
+        store: AssetStore,
+        nb_workers: int = 1,
+        manifest: Manifest = None,
+    ):
+        self.path_dir_archive_user = path_dir_archive_user
+        self.store = store
+        self.nb_workers = max(1, nb_workers)
+        self.manifest = manifest
+        self.assets = {}
+        self._pending = []
+
+    def add(self, url: str, filename: str = None) -> str:
+        """Register a picture to download. Return its path, relative to the user archive directory."""
+        if url in self.assets:
+            return self.assets[url]
+        if filename is None:
+            filename = url.split("/")[-1]
+        path_file = os.path.join("img", filename)
+        self.assets[url] = path_file
+        self._pending.append((url, path_file))
+        return path_file
+
+    def download_all(self):
+        """Download all pictures registered since the last call, which are not already present"""
+        pending, self._pending = self._pending, []
+        missing = [
+            (url, path_file)
+            for url, path_file in pending
+            if not self._is_present(url, path_file)
+        ]
+        logger.debug(
+            f"Downloading {len(missing)}/{len(pending)} picture(s), the others are already present"
+        )
+        if not missing:
+            return
+
+        os.makedirs(os.path.join(self.path_dir_archive_user, "img"), exist_ok=True)
+        with ThreadPoolExecutor(max_workers=self.nb_workers) as executor:
+            futures = [
+                submit_in_context(executor, self._download, url, path_file)
+                for url, path_file in missing
+            ]
+            for future in futures:
+                future.result()
+
+    def _is_present(self, url: str, path_file: str) -> bool:
+        path_file = os.path.join(self.path_dir_archive_user, path_file)
+        if self.manifest is not None:
+            return self.manifest.has_asset(url, path_file)
+        return os.path.exists(path_file)
+
+    def _download(self, url: str, path_file: str):
+        path_file = os.path.join(self.path_dir_archive_user, path_file)
+        try:
+            sha256 = self.store.fetch(url)
+        except requests.RequestException as exception:
+            # A missing picture should not prevent archiving the blog
+            logger.warning(f'Failed to download picture "{url}": {exception!r}')
+            return
+        if sha256 is None:
+            return
+
+        self.store.link(sha256, path_file)
+        metrics.count("assets_downloaded")
+        if self.manifest is not None:
+            self.manifest.add_asset(url=url, path_file=path_file, sha256=sha256)
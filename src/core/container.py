@@ -0,0 +1,124 @@
+""" Single-file container of a user archive.
+A user archive can be packed into an uncompressed ZIP file (members are "stored"), next to the users directories, to
+avoid creating thousands of small files per user. Members are never compressed inside the container: pages already
+have pre-compressed siblings (packed as well) and pictures do not compress, thus the local server reads members in
+place, from a memory map of the container, without extracting them.
+Files shared with other archives, i.e. the pictures of the content-addressed store, are not packed: the container
+only records their path (a "link"), relative to its own directory, and they are read from there. The container is thus
+not self-contained, it must stay next to the store.
+"""
+
+import json
+import mmap
+import os
+import struct
+import time
+import uuid
+import zipfile
+
+EXTENSION_CONTAINER = ".zip"
+# Member holding the links of the container, by name
+FILENAME_LINKS = ".links.json"
+
+# Size of the fixed part of a ZIP local file header, followed by the name and extra field
+SIZE_LOCAL_HEADER = 30
+STRUCT_LOCAL_HEADER_LENGTHS = struct.Struct("<HH")
+
+
+def pack_directory(
+    path_dir: str,
+    path_file_container: str,
+    filenames_kept: tuple = (),
+    links: dict[str, str] = None,
+):
+    """Pack the files of a directory into a container, written atomically, then remove them from the directory.
+    The files named in `filenames_kept` (at the top of the directory) are neither packed nor removed.
+    The files named in `links` are removed without being packed, the container only records the path they are read
+    from, relative to the container directory."""
+    links = links or {}
+    paths_files = []
+    paths_files_linked = []
+    for path_dir_current, dirnames, filenames in os.walk(path_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path_file = os.path.join(path_dir_current, filename)
+            path_relative = os.path.relpath(path_file, path_dir)
+            if path_relative in filenames_kept:
+                continue
+            name = path_relative.replace(os.sep, "/")
+            if name in links:
+                paths_files_linked.append(path_file)
+            else:
+                paths_files.append((path_file, name))
+
+    path_file_tmp = f"{path_file_container}.{uuid.uuid4().hex}.part"
+    with zipfile.ZipFile(
+        path_file_tmp, "w", compression=zipfile.ZIP_STORED, strict_timestamps=False
+    ) as container:
+        for path_file, name in paths_files:
+            container.write(path_file, arcname=name)
+        if links:
+            container.writestr(FILENAME_LINKS, json.dumps(links, sort_keys=True))
+    os.replace(path_file_tmp, path_file_container)
+
+    # Only the packed and linked files are removed, then the directories left empty
+    for path_file, _ in paths_files:
+        os.remove(path_file)
+    for path_file in paths_files_linked:
+        os.remove(path_file)
+    for path_dir_current, _, _ in sorted(os.walk(path_dir), reverse=True):
+        if path_dir_current != path_dir and not os.listdir(path_dir_current):
+            os.rmdir(path_dir_current)
+
+
+class Container(object):
+    """
+    Read-only access to the members of a container, through a memory map of the whole file.
+    The offsets of the members data are read once from the ZIP headers, then members are slices of the map: reading
+    one does not copy it, and the pages of the container stay in the OS page cache, shared by all the server threads.
+    Linked files are not members, see `get_path_link`.
+    """
+
+    def __init__(self, path_file: str):
+        self.path_file = path_file
+        with open(path_file, "rb") as fp:
+            stat = os.fstat(fp.fileno())
+            self.mtime_ns = stat.st_mtime_ns
+            # The map keeps its own reference to the file
+            self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            with zipfile.ZipFile(fp) as container:
+                infos = container.infolist()
+
+        # Data offset, size and modification time of each member, by name
+        self.members = {}
+        for info in infos:
+            if info.is_dir() or info.compress_type != zipfile.ZIP_STORED:
+                continue
+            # The name and extra field of the local header can differ in length from the central directory ones
+            length_name, length_extra = STRUCT_LOCAL_HEADER_LENGTHS.unpack_from(
+                self._mmap, info.header_offset + 26
+            )
+            offset = info.header_offset + SIZE_LOCAL_HEADER + length_name + length_extra
+            mtime = time.mktime(info.date_time + (0, 0, -1))
+            self.members[info.filename] = (offset, info.file_size, mtime)
+
+        # Paths of the linked files, relative to the container directory, by name
+        self.links = {}
+        if FILENAME_LINKS in self.members:
+            self.links = json.loads(bytes(self.get(FILENAME_LINKS)))
+            del self.members[FILENAME_LINKS]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.members
+
+    def get(self, name: str) -> memoryview:
+        """Content of a member, without copying it"""
+        offset, size, _ = self.members[name]
+        return memoryview(self._mmap)[offset : offset + size]
+
+    def get_path_link(self, name: str) -> str | None:
+        """Path of a linked file, or None if the name is not a link"""
+        path_relative = self.links.get(name)
+        if path_relative is None:
+            return None
+        return os.path.join(os.path.dirname(self.path_file), path_relative)
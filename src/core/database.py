@@ -0,0 +1,30 @@
+""" SQLite databases of the on-disk stores (page cache, asset store, search index).
+A store only holds the path of its database, and opens a new connection for each operation with `connect`: no
+connection is shared between threads, nor inherited by a forked process, thus the stores can be shared by thread and
+process workers. Databases are in WAL mode, so that readers do not block the writer.
+"""
+
+import contextlib
+import os
+import sqlite3
+
+
+def create(path_file: str, schema: str):
+    """Create a database and its directory if needed, then its tables with the given script"""
+    if os.path.dirname(path_file):
+        os.makedirs(os.path.dirname(path_file), exist_ok=True)
+    with connect(path_file) as connection:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(schema)
+
+
+@contextlib.contextmanager
+def connect(path_file: str):
+    """Open a connection to a database for a single operation: committed on success, rolled back on failure, and
+    closed in any case"""
+    connection = sqlite3.connect(path_file, timeout=60)
+    try:
+        with connection:
+            yield connection
+    finally:
+        connection.close()
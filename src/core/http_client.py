@@ -0,0 +1,402 @@
+""" Shared HTTP client module.
+Every network call of the project goes through the `http_client` object defined here. It keeps a pooled session
+(keep-alive connections per host), retries transient failures (429 and 5xx) with an exponential backoff, and counts
+everything it does.
+Requests belong to a class of hosts, blog pages or pictures, limited by a token bucket (requests per second) and an
+adaptive concurrency limit, shared by all the fetch points (see `rate_limit`): one for all the blog pages, and one per
+host for the pictures. Limits are enforced within a
+process: when several processes send requests, each one is given an equal share of them (see `share_limits`).
+Responses can be written to an on-disk page cache, and replayed from it without any network access.
+
+This module, and the core modules it imports (rate limits, page cache, database), must not import the `logger` module,
+as `common` depends on it.
+"""
+
+import contextlib
+import contextvars
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from core.page_cache import PageCache, make_response
+from core.rate_limit import AimdLimiter, TokenBucket
+
+STATUS_RETRY = (429, 500, 502, 503, 504)
+
+# Classes of hosts, limited separately: skyrock pages (and stylesheets), and the pictures CDN
+KIND_PAGES = "pages"
+KIND_ASSETS = "assets"
+
+# Counters of the job (e.g. the archived user) running in the current context, if any
+_stats_job = contextvars.ContextVar("stats_job", default=None)
+
+
+class HttpStats(object):
+    """Counters of all the requests made during a run"""
+
+    # Upper bounds (in seconds) of the latency histogram buckets, the last bucket takes everything else
+    latency_buckets = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.nb_requests = 0
+        self.nb_bytes = 0
+        self.nb_retries = 0
+        self.nb_errors = 0
+        self.nb_cache_hits = 0
+        self.latency_total = 0.0
+        self.latency_histogram = [0] * (len(self.latency_buckets) + 1)
+
+    def record(self, latency: float, nb_bytes: int, nb_retries: int, failed: bool):
+        with self._lock:
+            self.nb_requests += 1
+            self.nb_bytes += nb_bytes
+            self.nb_retries += nb_retries
+            self.nb_errors += int(failed)
+            self.latency_total += latency
+            for i, bucket in enumerate(self.latency_buckets):
+                if latency <= bucket:
+                    break
+            else:
+                i = len(self.latency_buckets)
+            self.latency_histogram[i] += 1
+
+    def add_bytes(self, nb_bytes: int):
+        with self._lock:
+            self.nb_bytes += nb_bytes
+
+    def add_cache_hit(self):
+        with self._lock:
+            self.nb_cache_hits += 1
+
+    def merge(self, other: "HttpStats"):
+        """Add the counters of another `HttpStats`, e.g. of requests made before the job"""
+        state = other.__getstate__()
+        with self._lock:
+            self.nb_requests += state["nb_requests"]
+            self.nb_bytes += state["nb_bytes"]
+            self.nb_retries += state["nb_retries"]
+            self.nb_errors += state["nb_errors"]
+            self.nb_cache_hits += state["nb_cache_hits"]
+            self.latency_total += state["latency_total"]
+            self.latency_histogram = [
+                a + b for a, b in zip(self.latency_histogram, state["latency_histogram"])
+            ]
+
+    def __getstate__(self) -> dict:
+        # The lock cannot be pickled, to be sent to or from a process worker
+        with self._lock:
+            state = self.__dict__.copy()
+            del state["_lock"]
+            state["latency_histogram"] = list(self.latency_histogram)
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            labels = [f"<={bucket}s" for bucket in self.latency_buckets]
+            labels.append(f">{self.latency_buckets[-1]}s")
+            return {
+                "requests": self.nb_requests,
+                "bytes": self.nb_bytes,
+                "retries": self.nb_retries,
+                "errors": self.nb_errors,
+                "cache_hits": self.nb_cache_hits,
+                "latency_mean": (
+                    self.latency_total / self.nb_requests if self.nb_requests else 0.0
+                ),
+                "latency_histogram": dict(zip(labels, self.latency_histogram)),
+            }
+
+    def __str__(self) -> str:
+        stats = self.to_dict()
+        return (
+            f"{stats['requests']} request(s), {stats['bytes']} byte(s), {stats['retries']} retry(ies), "
+            f"{stats['errors']} error(s), {stats['cache_hits']} cache hit(s), "
+            f"mean latency {stats['latency_mean']:.3f}s"
+        )
+
+
+class HttpClient(object):
+    """Pooled HTTP client shared by all the fetch points"""
+
+    def __init__(
+        self,
+        timeout: float = 30.0,
+        max_retries: int = 3,
+        backoff_factor: float = 0.5,
+        max_concurrency_pages: int = 4,
+        max_concurrency_assets: int = 4,
+        rate_pages: float = 0.0,
+        rate_assets: float = 0.0,
+        burst: int = 1,
+        latency_target: float = 0.0,
+    ):
+        self.stats = HttpStats()
+        self.cache = None
+        self.replay = False
+        self.configure(
+            timeout=timeout,
+            max_retries=max_retries,
+            backoff_factor=backoff_factor,
+            max_concurrency_pages=max_concurrency_pages,
+            max_concurrency_assets=max_concurrency_assets,
+            rate_pages=rate_pages,
+            rate_assets=rate_assets,
+            burst=burst,
+            latency_target=latency_target,
+        )
+
+    def configure(
+        self,
+        timeout: float,
+        max_retries: int,
+        backoff_factor: float,
+        max_concurrency_pages: int,
+        max_concurrency_assets: int,
+        rate_pages: float = 0.0,
+        rate_assets: float = 0.0,
+        burst: int = 1,
+        latency_target: float = 0.0,
+    ):
+        """(Re)build the underlying session and the limits with the given parameters.
+        Concurrency limits are the maximum numbers of requests in flight towards each class of hosts, across all the
+        fetch points. Rates are in requests per second (0 for unlimited), a request slower than `latency_target`
+        seconds (0 to ignore the latency) lowers the concurrency of its class of hosts."""
+        self._configuration = dict(
+            timeout=timeout,
+            max_retries=max_retries,
+            backoff_factor=backoff_factor,
+            max_concurrency_pages=max_concurrency_pages,
+            max_concurrency_assets=max_concurrency_assets,
+            rate_pages=rate_pages,
+            rate_assets=rate_assets,
+            burst=burst,
+            latency_target=latency_target,
+        )
+        self.timeout = timeout
+        self._limits = {
+            KIND_PAGES: (max(1, max_concurrency_pages), rate_pages),
+            KIND_ASSETS: (max(1, max_concurrency_assets), rate_assets),
+        }
+        self._burst = burst
+        self._latency_target = latency_target
+        self.share_limits(1)
+
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=STATUS_RETRY,
+            allowed_methods=("GET", "HEAD"),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        # Keep as many pooled connections per host as requests we allow in flight towards it
+        adapter = HTTPAdapter(
+            max_retries=retry,
+            pool_connections=32,
+            pool_maxsize=max(concurrency for concurrency, _ in self._limits.values()),
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def share_limits(self, nb_shares: int):
+        """Enforce only one out of `nb_shares` equal shares of the configured limits, so that as many processes
+        sending requests stay within them altogether. Concurrencies and bursts are rounded down, to at least 1.
+        Each process still adapts its own concurrency to the congestion it observes."""
+        self.nb_shares = max(1, nb_shares)
+        # Token bucket and limiter of each group of hosts, created on first use
+        self._limiters = {}
+        self._limiters_lock = threading.Lock()
+        self._get_limiters(KIND_PAGES, "")
+
+    def _get_limiters(self, kind: str, url: str) -> tuple[TokenBucket, AimdLimiter]:
+        """Token bucket and limiter of a request. Blog pages are all limited together, while each host of pictures is
+        limited apart: pictures hotlinked from a slow or dead host must not lower the concurrency towards the CDN."""
+        key = kind
+        if kind == KIND_ASSETS:
+            key = f"{kind}:{urllib.parse.urlsplit(url).hostname}"
+        with self._limiters_lock:
+            limiters = self._limiters.get(key)
+            if limiters is None:
+                concurrency, rate = self._limits[kind]
+                limiters = self._limiters[key] = (
+                    TokenBucket(
+                        rate=rate / self.nb_shares,
+                        burst=max(1, self._burst // self.nb_shares),
+                    ),
+                    AimdLimiter(
+                        limit_max=max(1, concurrency // self.nb_shares),
+                        latency_target=self._latency_target,
+                    ),
+                )
+            return limiters
+
+    def set_cache(self, cache: PageCache | None, replay: bool = False):
+        """Write the responses (but streamed ones) to the given cache. In replay mode, responses are read from the
+        cache only, and URLs missing from it are answered with a 404 without any network access."""
+        if replay and cache is None:
+            raise ValueError("Replay mode requires a page cache.")
+        self.cache = cache
+        self.replay = replay
+
+    def get_settings(self) -> dict:
+        """Settings of the client (configuration, share of the limits, cache), to apply to the client of another
+        process with `apply_settings`"""
+        return {
+            "configuration": self._configuration,
+            "nb_shares": self.nb_shares,
+            "cache": self.cache,
+            "replay": self.replay,
+        }
+
+    def apply_settings(self, settings: dict):
+        self.configure(**settings["configuration"])
+        self.share_limits(settings["nb_shares"])
+        self.set_cache(settings["cache"], replay=settings["replay"])
+
+    @contextlib.contextmanager
+    def track(self):
+        """Count the requests made in the current context (and the contexts copied from it) in a dedicated
+        `HttpStats` object, on top of the run counters."""
+        stats = HttpStats()
+        token = _stats_job.set(stats)
+        try:
+            yield stats
+        finally:
+            _stats_job.reset(token)
+
+    def get(self, url: str, kind: str = KIND_PAGES, **kwargs) -> requests.Response:
+        return self.request("GET", url, kind=kind, **kwargs)
+
+    def head(self, url: str, kind: str = KIND_PAGES, **kwargs) -> requests.Response:
+        return self.request("HEAD", url, kind=kind, **kwargs)
+
+    def request(
+        self, method: str, url: str, kind: str = KIND_PAGES, **kwargs
+    ) -> requests.Response:
+        """Send a request, within the limits of its class of hosts (`KIND_PAGES` or `KIND_ASSETS`).
+        A streamed response holds its slot until closed, thus must be used as a context manager."""
+        if self.replay:
+            return self._replay(url)
+
+        kwargs.setdefault("timeout", self.timeout)
+        bucket, limiter = self._get_limiters(kind, url)
+        epoch = limiter.acquire()
+        start = time.perf_counter()
+        try:
+            bucket.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.RequestException:
+                self._record(
+                    latency=time.perf_counter() - start,
+                    nb_bytes=0,
+                    nb_retries=0,
+                    failed=True,
+                )
+                raise
+        except BaseException:
+            limiter.release(epoch, time.perf_counter() - start, congested=True)
+            raise
+        nb_retries = _count_retries(response)
+        congested = response.status_code in STATUS_RETRY or nb_retries > 0
+
+        def release():
+            limiter.release(epoch, time.perf_counter() - start, congested)
+
+        if kwargs.get("stream"):
+            # The body is transferred while the caller reads it: the transfer takes the slot, and its duration is
+            # the latency seen by the limiter
+            _release_on_close(response, release)
+        else:
+            release()
+
+        # Streamed bodies are counted by the caller while being consumed
+        nb_bytes = 0 if kwargs.get("stream") else len(response.content)
+        self._record(
+            latency=time.perf_counter() - start,
+            nb_bytes=nb_bytes,
+            nb_retries=nb_retries,
+            failed=response.status_code >= 400,
+        )
+
+        # Transient failures are not cached, streamed bodies are not even read here
+        if (
+            self.cache is not None
+            and method == "GET"
+            and not kwargs.get("stream")
+            and response.status_code not in STATUS_RETRY
+        ):
+            self.cache.put(url, response)
+        return response
+
+    def _replay(self, url: str) -> requests.Response:
+        response = self.cache.get(url)
+        if response is None:
+            return make_response(url=url, status=404, headers={}, body=b"")
+
+        self.stats.add_cache_hit()
+        stats_job = _stats_job.get()
+        if stats_job is not None:
+            stats_job.add_cache_hit()
+        return response
+
+    def add_bytes(self, nb_bytes: int):
+        """Count bytes of a streamed body"""
+        self.stats.add_bytes(nb_bytes)
+        stats_job = _stats_job.get()
+        if stats_job is not None:
+            stats_job.add_bytes(nb_bytes)
+
+    def _record(self, **kwargs):
+        self.stats.record(**kwargs)
+        stats_job = _stats_job.get()
+        if stats_job is not None:
+            stats_job.record(**kwargs)
+
+    def get_limits(self) -> dict:
+        """Current limits of the blog pages, and of each host of pictures ("assets:<host>"), in this process, and the
+        number of processes sharing them"""
+        with self._limiters_lock:
+            limiters = dict(self._limiters)
+        return {
+            key: {**limiter.to_dict(), "rate": bucket.rate, "shares": self.nb_shares}
+            for key, (bucket, limiter) in sorted(limiters.items())
+        }
+
+
+def _release_on_close(response: requests.Response, release):
+    """Call `release` once, when the response is closed (e.g. leaving its `with` block)"""
+    close = response.close
+    released = False
+
+    def close_and_release():
+        nonlocal released
+        try:
+            close()
+        finally:
+            if not released:
+                released = True
+                release()
+
+    response.close = close_and_release
+
+
+def _count_retries(response: requests.Response) -> int:
+    retries = getattr(response.raw, "retries", None)
+    if retries is None:
+        return 0
+    return len(retries.history)
+
+
+http_client = HttpClient()
@@ -0,0 +1,196 @@
+import json
+import os
+import threading
+
+from core.post import Post
+
+
+class Manifest(object):
+    """
+    Manifest of a user archive.
+    Keep track of what has already been archived in the user directory, so that an interrupted or repeated run only
+    fetches what is missing:
+    * the blog metadata (title, description, pictures URLs, number of pages) and its theme colors,
+    * the fetched pages, with the ids of their posts (the "a-..." div ids),
+    * the downloaded assets (keyed by their path in the archive), with their URL and SHA-256 hash.
+
+    The manifest itself is a small JSON file, only rewritten when the metadata is set and when the archive is
+    complete. The fetched pages and downloaded assets are appended to a JSON-lines journal in the meantime, so that
+    recording one costs a single short write instead of rewriting the whole manifest. The journal is replayed on load,
+    and compacted into the manifest file on completion. The posts contents are appended to a separate JSON-lines file
+    as well, only their offsets in this file being kept in memory. This file is only indexed when first needed, i.e.
+    never for a complete archive, see also `is_complete`.
+    """
+
+    FILENAME = "manifest.json"
+    FILENAME_JOURNAL = "manifest.jsonl"
+    FILENAME_POSTS = "posts.jsonl"
+
+    def __init__(self, path_dir_archive_user: str):
+        self.path_dir_archive_user = path_dir_archive_user
+        self.path_file = os.path.join(path_dir_archive_user, self.FILENAME)
+        self.path_file_journal = os.path.join(path_dir_archive_user, self.FILENAME_JOURNAL)
+        self.path_file_posts = os.path.join(path_dir_archive_user, self.FILENAME_POSTS)
+        self._lock = threading.RLock()
+
+        self.complete = False
+        self.metadata = None
+        self.theme = None
+        self.pages = {}
+        self.assets = {}
+        # Offsets of the posts in their file, by id, indexed on first use
+        self._offsets_posts = None
+        self.load()
+
+    @classmethod
+    def is_complete(cls, path_dir_archive_user: str) -> bool:
+        """Whether a user archive is complete, only reading the manifest file"""
+        try:
+            with open(os.path.join(path_dir_archive_user, cls.FILENAME)) as fp:
+                return json.load(fp)["complete"]
+        except FileNotFoundError:
+            return False
+
+    def load(self):
+        if os.path.exists(self.path_file):
+            with open(self.path_file) as fp:
+                manifest = json.load(fp)
+            self.complete = manifest["complete"]
+            self.metadata = manifest["metadata"]
+            self.theme = manifest["theme"]
+            self.pages = manifest["pages"]
+            self.assets = manifest["assets"]
+
+        # Changes recorded since the manifest file was last written
+        if os.path.exists(self.path_file_journal):
+            with open(self.path_file_journal, "r+b") as fp:
+                offset = 0
+                for line in fp:
+                    if not line.endswith(b"\n"):
+                        # Last line truncated by an interruption
+                        fp.truncate(offset)
+                        break
+                    self._apply(json.loads(line))
+                    offset += len(line)
+
+    @property
+    def offsets_posts(self) -> dict[str, int]:
+        with self._lock:
+            if self._offsets_posts is None:
+                self._offsets_posts = self._index_posts()
+            return self._offsets_posts
+
+    def _index_posts(self) -> dict[str, int]:
+        offsets_posts = {}
+        if os.path.exists(self.path_file_posts):
+            with open(self.path_file_posts, "r+b") as fp:
+                offset = 0
+                for line in fp:
+                    if not line.endswith(b"\n"):
+                        # Last line truncated by an interruption, drop it before appending new posts
+                        fp.truncate(offset)
+                        break
+                    post = json.loads(line)
+                    offsets_posts[post["id"]] = offset
+                    offset += len(line)
+        return offsets_posts
+
+    def reset(self):
+        """Forget everything archived by previous runs"""
+        with self._lock:
+            self.complete = False
+            self.metadata = None
+            self.theme = None
+            self.pages = {}
+            self.assets = {}
+            self._offsets_posts = {}
+            for path_file in (self.path_file, self.path_file_journal, self.path_file_posts):
+                if os.path.exists(path_file):
+                    os.remove(path_file)
+
+    def save(self):
+        """Atomically write the manifest file, compacting the journal into it"""
+        with self._lock:
+            os.makedirs(self.path_dir_archive_user, exist_ok=True)
+            path_file_tmp = self.path_file + ".tmp"
+            with open(path_file_tmp, "w") as fp:
+                json.dump(
+                    {
+                        "complete": self.complete,
+                        "metadata": self.metadata,
+                        "theme": self.theme,
+                        "pages": self.pages,
+                        "assets": self.assets,
+                    },
+                    fp,
+                )
+            os.replace(path_file_tmp, self.path_file)
+            if os.path.exists(self.path_file_journal):
+                os.remove(self.path_file_journal)
+
+    def _append(self, entry: dict):
+        """Record a change in the journal, with a single write"""
+        with self._lock:
+            os.makedirs(self.path_dir_archive_user, exist_ok=True)
+            with open(self.path_file_journal, "ab") as fp:
+                fp.write(json.dumps(entry).encode() + b"\n")
+
+    def _apply(self, entry: dict):
+        if "page" in entry:
+            self.pages[str(entry["page"])] = entry["posts"]
+        else:
+            self.assets[entry["asset"]] = {"url": entry["url"], "sha256": entry["sha256"]}
+
+    def set_complete(self, complete: bool):
+        with self._lock:
+            self.complete = complete
+            self.save()
+
+    def set_metadata(self, metadata: dict, theme: dict):
+        with self._lock:
+            self.metadata = metadata
+            self.theme = theme
+            self.save()
+
+    def has_page(self, page_number: int) -> bool:
+        page = self.pages.get(str(page_number))
+        if page is None:
+            return False
+        offsets_posts = self.offsets_posts
+        return all(post_id in offsets_posts for post_id in page)
+
+    def get_page_posts(self, page_number: int) -> list[Post]:
+        posts = []
+        offsets_posts = self.offsets_posts
+        with open(self.path_file_posts, "rb") as fp:
+            for post_id in self.pages[str(page_number)]:
+                fp.seek(offsets_posts[post_id])
+                posts.append(Post.from_dict(json.loads(fp.readline())))
+        return posts
+
+    def add_page(self, page_number: int, posts: list[Post]):
+        with self._lock:
+            os.makedirs(self.path_dir_archive_user, exist_ok=True)
+            # Indexed first, dropping a truncated last post
+            offsets_posts = self.offsets_posts
+            with open(self.path_file_posts, "ab") as fp:
+                for post in posts:
+                    offsets_posts[post.id] = fp.tell()
+                    fp.write(json.dumps(post.to_dict()).encode() + b"\n")
+            entry = {"page": page_number, "posts": [post.id for post in posts]}
+            self._apply(entry)
+            self._append(entry)
+
+    def has_asset(self, url: str, path_file: str) -> bool:
+        asset = self.assets.get(os.path.relpath(path_file, self.path_dir_archive_user))
+        return asset is not None and asset["url"] == url and os.path.exists(path_file)
+
+    def add_asset(self, url: str, path_file: str, sha256: str):
+        entry = {
+            "asset": os.path.relpath(path_file, self.path_dir_archive_user),
+            "url": url,
+            "sha256": sha256,
+        }
+        with self._lock:
+            self._apply(entry)
+            self._append(entry)
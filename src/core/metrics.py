@@ -0,0 +1,128 @@
+""" Per-stage timing and counters.
+Stages of the archiving are wrapped in `span`s, which accumulate their count and duration into the `Metrics` of the
+job (i.e. the archived user) running in the current context. Outside of a tracked job, spans cost almost nothing.
+
+```python
+from core import metrics
+
+with metrics.track() as metrics_user:
+    with metrics.span("reader.parse_page"):
+        ...
+    metrics.count("posts", 5)
+```
+
+Spans running concurrently in worker threads are all accumulated, thus the total duration of a stage can exceed the
+wall-clock duration of the job.
+"""
+
+import contextlib
+import contextvars
+import threading
+import time
+
+_metrics_job = contextvars.ContextVar("metrics_job", default=None)
+
+
+class Metrics(object):
+    """Durations of the stages and counters of a job"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.spans = {}
+        self.counters = {}
+
+    def add_span(self, name: str, duration: float):
+        with self._lock:
+            count, total = self.spans.get(name, (0, 0.0))
+            self.spans[name] = (count + 1, total + duration)
+
+    def add(self, name: str, value: int | float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def merge(self, other: "Metrics"):
+        """Add the spans and counters of another `Metrics`, e.g. of stages run before the job"""
+        with other._lock:
+            spans = dict(other.spans)
+            counters = dict(other.counters)
+        with self._lock:
+            for name, (count, total) in spans.items():
+                count_self, total_self = self.spans.get(name, (0, 0.0))
+                self.spans[name] = (count_self + count, total_self + total)
+            for name, value in counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def __getstate__(self) -> dict:
+        # The lock cannot be pickled, to be sent to or from a process worker
+        with self._lock:
+            return {"spans": dict(self.spans), "counters": dict(self.counters)}
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "spans": {
+                    name: {"count": count, "duration": round(total, 6)}
+                    for name, (count, total) in sorted(self.spans.items())
+                },
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+
+def merge(metrics_dicts: list[dict]) -> dict:
+    """Aggregate the `to_dict` of several jobs"""
+    spans = {}
+    counters = {}
+    for metrics_dict in metrics_dicts:
+        for name, span_dict in metrics_dict["spans"].items():
+            aggregate = spans.setdefault(name, {"count": 0, "duration": 0.0})
+            aggregate["count"] += span_dict["count"]
+            aggregate["duration"] = round(aggregate["duration"] + span_dict["duration"], 6)
+        for name, value in metrics_dict["counters"].items():
+            counters[name] = counters.get(name, 0) + value
+    return {
+        "spans": dict(sorted(spans.items())),
+        "counters": dict(sorted(counters.items())),
+    }
+
+
+@contextlib.contextmanager
+def track():
+    """Accumulate the spans and counters of the current context (and the contexts copied from it) into a new
+    `Metrics` object"""
+    metrics = Metrics()
+    token = _metrics_job.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _metrics_job.reset(token)
+
+
+@contextlib.contextmanager
+def span(name: str):
+    metrics = _metrics_job.get()
+    if metrics is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_span(name, time.perf_counter() - start)
+
+
+def add_span(name: str, duration: float):
+    """Record a span measured elsewhere, e.g. in a process worker"""
+    metrics = _metrics_job.get()
+    if metrics is not None:
+        metrics.add_span(name, duration)
+
+
+def count(name: str, value: int | float = 1):
+    metrics = _metrics_job.get()
+    if metrics is not None:
+        metrics.add(name, value)
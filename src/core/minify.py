@@ -0,0 +1,56 @@
+""" Output size optimizations.
+Minify the HTML and CSS written in the archives, and write pre-compressed `.gz` / `.br` siblings of the files, which
+the local server sends as is to the clients accepting them. Brotli is optional, used when installed.
+"""
+
+import gzip
+import os
+import re
+import uuid
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+PATTERN_HTML_LINE_BREAKS = re.compile(r"[ \t]*\n\s*")
+PATTERN_HTML_BETWEEN_TAGS = re.compile(r">\n<")
+PATTERN_CSS_COMMENTS = re.compile(r"/\*.*?\*/", re.DOTALL)
+PATTERN_CSS_SPACES = re.compile(r"\s+")
+PATTERN_CSS_AROUND_PUNCTUATION = re.compile(r"\s*([{};,>])\s*")
+PATTERN_CSS_AFTER_COLON = re.compile(r":\s+")
+
+# Suffix of the pre-compressed files, by content coding
+SUFFIXES_ENCODING = {"br": ".br", "gzip": ".gz"}
+
+
+def minify_html(html_content: str) -> str:
+    """Drop the indentation and the line breaks between tags.
+    Line breaks inside text are kept (as a single one), which keeps inline scripts and preformatted text valid."""
+    html_content = PATTERN_HTML_LINE_BREAKS.sub("\n", html_content)
+    return PATTERN_HTML_BETWEEN_TAGS.sub("><", html_content).strip()
+
+
+def minify_css(css_content: str) -> str:
+    css_content = PATTERN_CSS_COMMENTS.sub("", css_content)
+    css_content = PATTERN_CSS_SPACES.sub(" ", css_content)
+    css_content = PATTERN_CSS_AROUND_PUNCTUATION.sub(r"\1", css_content)
+    css_content = PATTERN_CSS_AFTER_COLON.sub(":", css_content)
+    return css_content.replace(";}", "}").strip()
+
+
+def write_compressed(path_file: str):
+    """Write the gzip (and brotli, if available) compressed siblings of a file"""
+    with open(path_file, "rb") as fp:
+        content = fp.read()
+
+    variants = {"gzip": gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(content, mode=brotli.MODE_TEXT)
+    for encoding, content_compressed in variants.items():
+        path_file_compressed = path_file + SUFFIXES_ENCODING[encoding]
+        # Unique temporary name, the shared static files can be written by concurrent workers
+        path_file_tmp = f"{path_file_compressed}.{uuid.uuid4().hex}.part"
+        with open(path_file_tmp, "wb") as fp:
+            fp.write(content_compressed)
+        os.replace(path_file_tmp, path_file_compressed)
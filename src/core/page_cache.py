@@ -0,0 +1,66 @@
+import json
+import time
+import zlib
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from core import database
+
+
+class PageCache(object):
+    """
+    On-disk cache of raw responses.
+    Responses are stored with their status and headers in a SQLite database, bodies being zlib-compressed. In replay
+    mode, the HTTP client reads responses from this cache only, so that a whole corpus can be processed again
+    without any network access. The cache can be shared by thread and process workers (see `database`).
+    """
+
+    def __init__(self, path_file: str):
+        self.path_file = path_file
+        database.create(
+            self.path_file,
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "url TEXT PRIMARY KEY, status INTEGER NOT NULL, headers TEXT NOT NULL, body BLOB NOT NULL, "
+            "fetched_at REAL NOT NULL)",
+        )
+
+    def put(self, url: str, response: requests.Response):
+        """Store a response, keyed by the requested URL (which can differ from the response one after redirects)"""
+        with database.connect(self.path_file) as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (url, status, headers, body, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                (
+                    url,
+                    response.status_code,
+                    json.dumps(dict(response.headers)),
+                    zlib.compress(response.content),
+                    time.time(),
+                ),
+            )
+
+    def get(self, url: str) -> requests.Response | None:
+        """Return the cached response of a URL, or None."""
+        with database.connect(self.path_file) as connection:
+            row = connection.execute(
+                "SELECT status, headers, body FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        status, headers, body = row
+        return make_response(
+            url=url, status=status, headers=json.loads(headers), body=zlib.decompress(body)
+        )
+
+
+def make_response(url: str, status: int, headers: dict, body: bytes) -> requests.Response:
+    """Build a response which was not received from the network"""
+    response = requests.Response()
+    response.url = url
+    response.status_code = status
+    response.headers = CaseInsensitiveDict(headers)
+    response.encoding = get_encoding_from_headers(response.headers)
+    response._content = body
+    response._content_consumed = True
+    return response
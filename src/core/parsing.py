@@ -0,0 +1,27 @@
+""" HTML parsing backend.
+BeautifulSoup is used with lxml when it is installed, as it is much faster than the pure-Python "html.parser".
+Parsing can be restricted to the elements we actually read with the strainers below, which saves building the
+parse tree of the rest of the page.
+"""
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml  # noqa: F401
+
+    PARSER = "lxml"
+except ImportError:
+    PARSER = "html.parser"
+
+# Only the posts of a page are read
+STRAINER_ARTICLES = SoupStrainer("div", id="articles_container")
+
+# Only the comments (and their pagination) of a post page are read
+STRAINER_COMMENTS = SoupStrainer("div", id="comments")
+
+# Only the picture of the profile picture page is read
+STRAINER_PROFILE_PICTURE = SoupStrainer("img", id="laphoto")
+
+
+def make_soup(html: str | bytes, parse_only: SoupStrainer = None) -> BeautifulSoup:
+    return BeautifulSoup(html, PARSER, parse_only=parse_only)
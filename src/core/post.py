@@ -1,40 +1,163 @@
-import os
+import hashlib
+import re
 
-from bs4 import Tag
+from core import metrics
 
-from common import save_picture
+PATTERN_SAFE_FILENAME = re.compile(r"[\w-]+")
+
+
+class Comment(object):
+    """A comment of a post, its text being kept as a sanitized HTML string"""
+
+    __slots__ = ("author", "date", "text")
+
+    def __init__(self, author: str, date: str, text: str):
+        self.author = author
+        self.date = date
+        self.text = text
+
+    def to_dict(self) -> dict:
+        return {"author": self.author, "date": self.date, "text": self.text}
+
+    @classmethod
+    def from_dict(cls, comment: dict) -> "Comment":
+        return cls(author=comment["author"], date=comment["date"], text=comment["text"])
 
 
 class Post(object):
     """
     Skyblog Post class
+    A compact record: the text is kept as an HTML string, extracted from the page by the reader, so that a post
+    does not hold any reference to the page parse tree. Posts can be pickled, sent across processes and cached.
+    The comments are None until they are fetched from the post page, if comments are archived.
     """
 
-    def __init__(self, text: Tag, image: str, date: str, title: str):
+    __slots__ = ("id", "text", "image_url", "date", "title", "url", "nb_comments", "comments")
+
+    def __init__(
+        self,
+        text: str,
+        image: str,
+        date: str,
+        title: str,
+        id: str = None,
+        url: str = None,
+        nb_comments: int = None,
+        comments: list[Comment] = None,
+    ):
+        self.id = id
         self.text = text
         self.image_url = image
         self.date = date
         self.title = title
+        # URL of the post own page, holding its comments
+        self.url = url
+        # Number of comments shown on the blog page, None if unknown
+        self.nb_comments = nb_comments
+        self.comments = comments
 
-    def to_html(self, folder_name: str):
-        html_content = '<div class="post" style="background-color: #{{ color_articles_background }}">'
-        if self.image_url is not None:
-            # Locally save the image inside the img folder itself inside the folderName
-            img_name = self.image_url.split("/")[-1]
-            save_picture(
-                path_dir_output=os.path.join(folder_name, "img"), url=self.image_url
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "text": self.text,
+            "image": self.image_url,
+            "date": self.date,
+            "title": self.title,
+            "url": self.url,
+            "nb_comments": self.nb_comments,
+            "comments": (
+                [comment.to_dict() for comment in self.comments]
+                if self.comments is not None
+                else None
+            ),
+        }
+
+    @classmethod
+    def from_dict(cls, post: dict) -> "Post":
+        # Posts recorded before comments were archived have no comments fields
+        comments = post.get("comments")
+        return cls(
+            id=post["id"],
+            text=post["text"],
+            image=post["image"],
+            date=post["date"],
+            title=post["title"],
+            url=post.get("url"),
+            nb_comments=post.get("nb_comments"),
+            comments=(
+                [Comment.from_dict(comment) for comment in comments]
+                if comments is not None
+                else None
+            ),
+        )
+
+    def get_image_filename(self) -> str | None:
+        """Name of the image file inside the img folder of the archive.
+        The name is prefixed by a hash of the URL, as different URLs can share the same basename."""
+        if self.image_url is None:
+            return None
+        prefix = hashlib.sha1(self.image_url.encode()).hexdigest()[:12]
+        return f"{prefix}_{self.image_url.split('/')[-1]}"
+
+    def get_comments_filename(self) -> str:
+        """Name of the JSON file of the comments inside the comments folder of the archive"""
+        if self.id is not None and PATTERN_SAFE_FILENAME.fullmatch(self.id):
+            return f"{self.id}.json"
+        # Never trust an id read from a page as a path
+        return f"{hashlib.sha1(str(self.id).encode()).hexdigest()[:12]}.json"
+
+    def to_html(
+        self,
+        color_articles_background: str,
+        color_block_title: str,
+        color_text_title: str,
+        thumbnails: list[tuple[int, str]] = None,
+    ) -> str:
+        """Render the post with the blog colors. The image must have been downloaded beforehand by the asset
+        stage. If given, the (width, path relative to the img folder) thumbnails of the image are shown inline, the
+        original being kept for the lightbox."""
+        with metrics.span("post.to_html"):
+            return self._to_html(
+                color_articles_background, color_block_title, color_text_title, thumbnails
             )
+
+    def _to_html(
+        self,
+        color_articles_background: str,
+        color_block_title: str,
+        color_text_title: str,
+        thumbnails: list[tuple[int, str]] = None,
+    ) -> str:
+        # The post id is kept as an anchor, search results link to it
+        attribute_id = f' id="{self.id}"' if self.id is not None else ""
+        html_content = f'<div class="post"{attribute_id} style="background-color: #{color_articles_background}">'
+        if self.image_url is not None:
+            img_name = self.get_image_filename()
             # Add the title to the html
-            html_content += f'<h2 style="background-color: #{{{{ color_block_title }}}};color: #{{{{ color_text_title }}}};display:block;margin:0;padding:0;text-align:center;">{self.title}</h2>'
+            html_content += f'<h2 style="background-color: #{color_block_title};color: #{color_text_title};display:block;margin:0;padding:0;text-align:center;">{self.title}</h2>'
 
             # Add the image to the html
-            html_content += f'<a href="img/{img_name}" class="lightbox" data-lightbox="post-images"><img src="img/{img_name}" /></a>'
+            if thumbnails:
+                srcset = ", ".join(f"img/{path} {width}w" for width, path in thumbnails)
+                html_img = f'<img src="img/{thumbnails[0][1]}" srcset="{srcset}" sizes="(max-width: 600px) 100vw, 600px" loading="lazy" />'
+            else:
+                html_img = f'<img src="img/{img_name}" loading="lazy" />'
+            html_content += f'<a href="img/{img_name}" class="lightbox" data-lightbox="post-images">{html_img}</a>'
 
         # Add the text to the html
-        html_content += self.text.prettify()
+        if self.text is not None:
+            html_content += self.text
 
         # Add the date to the html
         html_content += '<p class="date">' + self.date + "</p>"
+
+        # Add a collapsed comments section, its comments are loaded by the script when opened
+        if self.comments:
+            nb_comments = len(self.comments)
+            html_content += (
+                f'<details class="comments" data-src="comments/{self.get_comments_filename()}">'
+                f"<summary>{nb_comments} comment{'s' if nb_comments > 1 else ''}</summary></details>"
+            )
         html_content += "</div>"
 
         return html_content
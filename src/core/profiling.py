@@ -0,0 +1,62 @@
+""" Profiling of the jobs with cProfile.
+A job (i.e. an archived user) is profiled into a single stats file, including the work of its worker threads:
+
+```python
+from core import profiling
+
+with profiling.track("archives/.profiles/username.prof"):
+    ...
+```
+
+Since Python 3.12, a profiler sees all the threads of the process, but only one can be enabled at a time: jobs must
+not be profiled concurrently in the same process (see `Scheduler`). Before, a profiler only sees the thread enabling
+it, thus calls submitted to worker threads with `submit_in_context` are profiled apart, and merged into the job stats.
+"""
+
+import contextlib
+import contextvars
+import cProfile
+import pstats
+import sys
+
+PROFILE_ALL_THREADS = sys.version_info >= (3, 12)
+
+# Profiles of the worker threads of the job running in the current context, if profiled
+_profiles_job = contextvars.ContextVar("profiles_job", default=None)
+
+
+@contextlib.contextmanager
+def track(path_file: str | None):
+    """Profile the current context (and the worker threads started from it) into the given stats file, written even
+    if the job fails. Does nothing if the path is None."""
+    if path_file is None:
+        yield
+        return
+
+    profile = cProfile.Profile()
+    # Raises if another profiler is enabled (Python 3.12 and later)
+    profile.enable()
+    profiles = []
+    token = _profiles_job.set(profiles)
+    try:
+        yield
+    finally:
+        profile.disable()
+        _profiles_job.reset(token)
+        pstats.Stats(profile, *profiles).dump_stats(path_file)
+
+
+def run(fn, *args, **kwargs):
+    """Run a call in a worker thread, profiled into the job stats if the job is profiled and its profiler does not
+    see this thread"""
+    profiles = _profiles_job.get()
+    if profiles is None or PROFILE_ALL_THREADS:
+        return fn(*args, **kwargs)
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profile.disable()
+        profiles.append(profile)
@@ -0,0 +1,88 @@
+""" Rate and concurrency limits of the HTTP client.
+Requests are grouped by hosts (all the blog pages, each host of pictures), each group having a token bucket capping
+its rate of requests, and a concurrency limit adjusted AIMD-style: increased by one every `limit` successful requests, halved
+when the host shows congestion (429 / 5xx responses, retries, connection errors, or latency above a target).
+"""
+
+import threading
+import time
+
+
+class TokenBucket(object):
+    """Allow `rate` requests per second on average, with bursts of `burst` requests. A rate of 0 means unlimited."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    def acquire(self):
+        """Wait for a token"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+class AimdLimiter(object):
+    """Concurrency limit adjusted from the outcome of the requests, between 1 and `limit_max`"""
+
+    def __init__(
+        self, limit_max: int, latency_target: float = 0.0, decrease_factor: float = 0.5
+    ):
+        self.limit_max = max(1, limit_max)
+        self.limit = float(self.limit_max)
+        # Latency (in seconds) above which a request is a congestion signal, 0 to ignore the latency
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.nb_increases = 0
+        self.nb_decreases = 0
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        # Incremented on each decrease, so that requests started before it do not decrease the limit again
+        self._epoch = 0
+
+    def acquire(self) -> int:
+        """Wait for a free slot. Return the epoch to give back to `release`."""
+        with self._condition:
+            while self._in_flight >= int(self.limit):
+                self._condition.wait()
+            self._in_flight += 1
+            return self._epoch
+
+    def release(self, epoch: int, latency: float, congested: bool):
+        with self._condition:
+            self._in_flight -= 1
+            if self.latency_target > 0 and latency > self.latency_target:
+                congested = True
+            if congested:
+                if epoch == self._epoch:
+                    self.limit = max(1.0, self.limit * self.decrease_factor)
+                    self.nb_decreases += 1
+                    self._epoch += 1
+            elif self.limit < self.limit_max:
+                self.limit = min(self.limit_max, self.limit + 1 / self.limit)
+                self.nb_increases += 1
+            self._condition.notify_all()
+
+    def to_dict(self) -> dict:
+        with self._condition:
+            return {
+                "concurrency": round(self.limit, 2),
+                "concurrency_max": self.limit_max,
+                "in_flight": self._in_flight,
+                "increases": self.nb_increases,
+                "decreases": self.nb_decreases,
+            }
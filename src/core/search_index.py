@@ -0,0 +1,150 @@
+import html
+import re
+
+from core import database
+from core.post import Post
+
+PATTERN_TAG = re.compile(r"<[^>]*>")
+PATTERN_SPACES = re.compile(r"\s+")
+
+# Markers of the matches in snippets, replaced once the snippet is escaped
+MARK_START = "\x02"
+MARK_END = "\x03"
+
+
+class SearchIndex(object):
+    """
+    Full-text index of the archived posts, shared by all archived users.
+    Posts are stored in a plain table, (username, post id) being unique, and indexed by a SQLite FTS5 table over their
+    title, date, text and username. The index is filled incrementally, page by page, by the writer: archiving a user
+    again updates its posts instead of duplicating them. The index can be shared by thread and process workers (see
+    `database`).
+    """
+
+    def __init__(self, path_file: str):
+        self.path_file = path_file
+        database.create(
+            self.path_file,
+            """
+            CREATE TABLE IF NOT EXISTS posts (
+                rowid INTEGER PRIMARY KEY,
+                username TEXT NOT NULL,
+                post_id TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                title TEXT NOT NULL,
+                date TEXT NOT NULL,
+                text TEXT NOT NULL,
+                UNIQUE (username, post_id)
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+                title, date, text, username,
+                content='posts', content_rowid='rowid',
+                tokenize='unicode61 remove_diacritics 2'
+            );
+            CREATE TRIGGER IF NOT EXISTS posts_insert AFTER INSERT ON posts BEGIN
+                INSERT INTO posts_fts (rowid, title, date, text, username)
+                VALUES (new.rowid, new.title, new.date, new.text, new.username);
+            END;
+            CREATE TRIGGER IF NOT EXISTS posts_delete AFTER DELETE ON posts BEGIN
+                INSERT INTO posts_fts (posts_fts, rowid, title, date, text, username)
+                VALUES ('delete', old.rowid, old.title, old.date, old.text, old.username);
+            END;
+            CREATE TRIGGER IF NOT EXISTS posts_update AFTER UPDATE ON posts BEGIN
+                INSERT INTO posts_fts (posts_fts, rowid, title, date, text, username)
+                VALUES ('delete', old.rowid, old.title, old.date, old.text, old.username);
+                INSERT INTO posts_fts (rowid, title, date, text, username)
+                VALUES (new.rowid, new.title, new.date, new.text, new.username);
+            END;
+            """,
+        )
+
+    def add_posts(self, username: str, page_number: int, posts: list[Post]):
+        """Index the posts of an archived page, in a single transaction"""
+        rows = [
+            (
+                username,
+                post.id if post.id is not None else f"{page_number}-{i}",
+                page_number,
+                _html_to_text(post.title or ""),
+                post.date or "",
+                _html_to_text(post.text or ""),
+            )
+            for i, post in enumerate(posts)
+        ]
+        with database.connect(self.path_file) as connection:
+            connection.executemany(
+                """
+                INSERT INTO posts (username, post_id, page, title, date, text) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (username, post_id) DO UPDATE SET
+                    page = excluded.page, title = excluded.title, date = excluded.date, text = excluded.text
+                """,
+                rows,
+            )
+
+    def search(
+        self, query: str, username: str = None, limit: int = 20, offset: int = 0
+    ) -> list[dict]:
+        """Return the best matching posts. Every word of the query must match, a trailing "*" matches a prefix.
+        The snippets are escaped HTML, matches being wrapped in <mark> tags."""
+        query_fts = _to_fts_query(query)
+        if query_fts is None:
+            return []
+        # The user is matched in the FTS query to narrow the candidates early, then exactly on the posts table
+        parameters = (query_fts, limit, offset)
+        filter_username = ""
+        if username is not None:
+            query_fts = f"({query_fts}) AND username:{_quote(username)}"
+            filter_username = "AND posts.username = ?"
+            parameters = (query_fts, username, limit, offset)
+
+        with database.connect(self.path_file) as connection:
+            rows = connection.execute(
+                f"""
+                SELECT posts.username, posts.post_id, posts.page, posts.title, posts.date,
+                    snippet(posts_fts, 2, '{MARK_START}', '{MARK_END}', '…', 24)
+                FROM posts_fts JOIN posts ON posts.rowid = posts_fts.rowid
+                WHERE posts_fts MATCH ? {filter_username}
+                ORDER BY rank
+                LIMIT ? OFFSET ?
+                """,
+                parameters,
+            ).fetchall()
+        return [
+            {
+                "username": username,
+                "id": post_id,
+                "page": page,
+                "title": title,
+                "date": date,
+                "snippet": html.escape(snippet)
+                .replace(MARK_START, "<mark>")
+                .replace(MARK_END, "</mark>"),
+            }
+            for username, post_id, page, title, date, snippet in rows
+        ]
+
+    def count(self) -> int:
+        with database.connect(self.path_file) as connection:
+            return connection.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+
+
+def _html_to_text(html_content: str) -> str:
+    text = html.unescape(PATTERN_TAG.sub(" ", html_content))
+    return PATTERN_SPACES.sub(" ", text).strip()
+
+
+def _quote(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _to_fts_query(query: str) -> str | None:
+    """Turn a user query into a FTS5 query, quoting every word so that no FTS5 syntax can be injected"""
+    terms = []
+    for word in query.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*")
+        if word:
+            terms.append(_quote(word) + ("*" if prefix else ""))
+    if not terms:
+        return None
+    return " ".join(terms)
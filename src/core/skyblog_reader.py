@@ -1,21 +1,73 @@
-import os
 import re
-import shutil
+import time
+import urllib.parse
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-from tinycss import CSS21Parser
-import requests
-from bs4 import BeautifulSoup, ResultSet
+from bs4 import BeautifulSoup
 
 from logger import logger
 
-from core.utils import request_page
-
-from core.post import Post
+from core.http_client import http_client
+from core.utils import (
+    get_process_executor,
+    get_url_blog,
+    request_comments_page,
+    request_page,
+    submit_in_context,
+)
+
+from core import metrics
+from core.manifest import Manifest
+from core.parsing import (
+    STRAINER_ARTICLES,
+    STRAINER_COMMENTS,
+    STRAINER_PROFILE_PICTURE,
+    make_soup,
+)
+from core.post import Comment, Post
+from core.theme import Theme, extract_theme
+
+# Markup kept in the text of the posts and comments, see `_sanitize`
+TAGS_ALLOWED = frozenset(
+    "a abbr b big blockquote br center code del div em font h1 h2 h3 h4 h5 h6 hr i img ins li ol p pre q "
+    "s small span strike strong sub sup table tbody td tfoot th thead tr u ul".split()
+)
+# Elements dropped along with their content, the other ones not allowed are replaced by their content
+TAGS_DROPPED = frozenset(
+    "applet base button embed form frame frameset iframe input link math meta noscript object script "
+    "select style svg template textarea".split()
+)
+ATTRIBUTES_ALLOWED = frozenset(
+    "align alt class color colspan face height href rowspan size src style target title width".split()
+)
+ATTRIBUTES_URL = frozenset({"href", "src"})
+# Relative URLs have no scheme
+SCHEMES_URL_ALLOWED = frozenset({"", "http", "https", "mailto"})
 
 
 class SkyblogReader:
-    def __init__(self, username: str):
+    def __init__(
+        self,
+        username: str,
+        nb_workers: int = 1,
+        manifest: Manifest = None,
+        prettify: bool = False,
+        html_first_page: str = None,
+        nb_workers_parse: int = 0,
+        archive_comments: bool = False,
+        nb_workers_comments: int = 1,
+    ):
         self.username = username
+        self.nb_workers = max(1, nb_workers)
+        # Pages are parsed in a shared process pool, or in the fetching threads if 0
+        self.nb_workers_parse = nb_workers_parse
+        self.archive_comments = archive_comments
+        # Number of pages of comments fetched concurrently for the posts of a single blog page
+        self.nb_workers_comments = max(1, nb_workers_comments)
+        self.manifest = manifest
+        self.prettify = prettify
         self.max_page_number = None
         self.articles = None
         self.title = None
@@ -27,20 +79,36 @@ class SkyblogReader:
         self.color_block_title = None
         self.color_text_title = None
         self.color_articles_background = None
+        self._posts_first_page = None
+        # First page, if already fetched when checking that the user exists
+        self._html_first_page = html_first_page
 
     def get(self):
-        # Request first page once and parse it
-        html_first_page = request_page(self.username, page_number=1)
-        html_content = BeautifulSoup(html_first_page, "html.parser")
+        """Retrieve the blog metadata and all its articles at once"""
+        self.get_metadata()
+        self.articles = list(self.iter_articles())
+        logger.debug(f"Retrieved {len(self.articles)} article(s)")
+
+    def get_metadata(self):
+        """Retrieve everything but the articles, which can then be streamed with `iter_articles`"""
+        if self.manifest is not None and self.manifest.metadata is not None:
+            # Metadata already retrieved by a previous run
+            logger.debug("Resuming from the manifest")
+            self._set_metadata(self.manifest.metadata, Theme(**self.manifest.theme))
+            return
+
+        # Request first page once (unless already fetched) and parse it
+        html_first_page = self._html_first_page
+        self._html_first_page = None
+        if html_first_page is None:
+            html_first_page = request_page(self.username, page_number=1)
+        with metrics.span("reader.parse_page"):
+            html_content = make_soup(html_first_page)
 
         # Get the highest page number
         self.max_page_number = self.get_highest_page_number(html_content)
         logger.debug(f"Number of pages: {self.max_page_number}")
 
-        # Fetch all blog articles
-        self.articles = self.get_articles()
-        logger.debug(f"Retrieved {len(self.articles)} article(s)")
-
         # Get the profile title
         self.title = self.get_title(html_content)
         logger.debug(f"Blog title: {self.title}")
@@ -49,47 +117,185 @@ class SkyblogReader:
         self.description = self.get_description(html_content)
 
         # Get the mini-profile picture
-        self.url_profile_picture = self.get_url_profile_picture(
-            soup=html_content, username=self.username
-        )
+        with metrics.span("reader.profile_picture"):
+            self.url_profile_picture = self.get_url_profile_picture(
+                soup=html_content, username=self.username
+            )
         logger.debug(f"Profile picture URL: {self.url_profile_picture}")
 
         # Get the background picture URL
         self.url_background = self.get_background_picture_url(html_content)
         logger.debug(f"Background picture URL: {self.url_background}")
 
-        # Get the background color
-        self.color_background = self.get_color_background(html_content)
+        # Get all the template colors at once
+        with metrics.span("reader.theme"):
+            theme = extract_theme(html_content)
+        self._set_theme(theme)
+
+        # Record the metadata first, so that an interrupted run can be resumed without the first page
+        if self.manifest is not None:
+            self.manifest.set_metadata(metadata=self._get_metadata(), theme=vars(theme))
+
+        # Keep the posts of the first page, as it will not be requested again
+        with metrics.span("reader.extract_posts"):
+            posts = _html_to_post(html_content, prettify=self.prettify)
+        self._add_comments(posts, self._get_executor_parse())
+        self._posts_first_page = self._add_page_posts(1, posts)
+
+    def _get_metadata(self) -> dict:
+        return {
+            "max_page_number": self.max_page_number,
+            "title": self.title,
+            "description": self.description,
+            "url_profile_picture": self.url_profile_picture,
+            "url_background": self.url_background,
+        }
+
+    def _set_metadata(self, metadata: dict, theme: Theme):
+        self.max_page_number = metadata["max_page_number"]
+        self.title = metadata["title"]
+        self.description = metadata["description"]
+        self.url_profile_picture = metadata["url_profile_picture"]
+        self.url_background = metadata["url_background"]
+        self._set_theme(theme)
+
+    def _set_theme(self, theme: Theme):
+        self.color_background = theme.color_background
         logger.debug(f"Background color: #{self.color_background}")
-
-        # Get the theme color
-        self.color_theme = self.get_color_theme(html_content)
+        self.color_theme = theme.color_theme
         logger.debug(f"Theme color: #{self.color_theme}")
-
-        # Get the color of the title block
-        self.color_block_title = self.get_color_block_title(html_content)
+        self.color_block_title = theme.color_block_title
         logger.debug(f"Color of the block title: #{self.color_block_title}")
-
-        # Get the color of the title block
-        self.color_text_title = self.get_color_text_title(html_content)
+        self.color_text_title = theme.color_text_title
         logger.debug(f"Color of the text title: #{self.color_text_title}")
-
-        # Get the color of the articles block
-        self.color_articles_background = self.get_color_articles_background(
-            html_content
-        )
+        self.color_articles_background = theme.color_articles_background
         logger.debug(
             f"Color of the articles background: #{self.color_articles_background}"
         )
 
-    def get_articles(self):
-        # We expect to have at most self.pages * 5 posts to load
-        # Loop from 1.html until max_pages_number
-        posts = []
-        for i in range(1, self.max_page_number + 1):
-            html_content = request_page(self.username, page_number=i)
-            soup = BeautifulSoup(html_content, "html.parser")
-            posts += _html_to_post(soup)
+    def iter_articles(self) -> Iterator[Post]:
+        """Iterate through all blog articles, in order.
+        Pages are fetched concurrently, but at most `2 * nb_workers` pages are fetched ahead of the consumer, so
+        that the memory is bounded by the pages size rather than by the blog size.
+        If `nb_workers_parse` is set, pages are fetched by the threads (I/O tier), then handed to a shared process
+        pool to be parsed (parse tier), so that parsing scales with the number of CPUs. A fetching thread waits for
+        its page to be parsed, which bounds the pages queued between the two tiers.
+        """
+        # Reuse the already parsed first page if any, then fetch 2.html until max_pages_number
+        if self._posts_first_page is not None:
+            posts_first_page, self._posts_first_page = self._posts_first_page, None
+            yield from posts_first_page
+            page_numbers = range(2, self.max_page_number + 1)
+        else:
+            page_numbers = range(1, self.max_page_number + 1)
+
+        executor_parse = self._get_executor_parse()
+        nb_workers = self.nb_workers
+        if executor_parse is not None:
+            # Threads waiting for their page to be parsed do not fetch, make up for them
+            nb_workers += self.nb_workers_parse
+
+        if nb_workers == 1:
+            for page_number in page_numbers:
+                yield from self._get_page_posts(page_number, executor_parse)
+            return
+
+        # Futures are consumed in the pages order
+        with ThreadPoolExecutor(max_workers=nb_workers) as executor:
+            futures = deque()
+            for page_number in page_numbers:
+                futures.append(
+                    submit_in_context(
+                        executor, self._get_page_posts, page_number, executor_parse
+                    )
+                )
+                if len(futures) >= 2 * nb_workers:
+                    yield from futures.popleft().result()
+            while futures:
+                yield from futures.popleft().result()
+
+    def _get_executor_parse(self) -> ProcessPoolExecutor | None:
+        if self.nb_workers_parse > 0:
+            return get_process_executor("parse", self.nb_workers_parse)
+        return None
+
+    def _get_page_posts(
+        self, page_number: int, executor_parse: ProcessPoolExecutor = None
+    ) -> list[Post]:
+        if self.manifest is not None and self.manifest.has_page(page_number):
+            # Page already fetched by a previous run
+            posts = self.manifest.get_page_posts(page_number)
+            if not self.archive_comments or all(
+                post.comments is not None for post in posts
+            ):
+                return posts
+            # Page fetched by a previous run not archiving the comments, only fetch them
+            self._add_comments(posts, executor_parse)
+            self.manifest.add_page(page_number, posts)
+            return posts
+
+        html_content = request_page(self.username, page_number=page_number)
+        if executor_parse is None:
+            posts, durations = parse_page_posts(html_content, prettify=self.prettify)
+        else:
+            posts, durations = executor_parse.submit(
+                parse_page_posts, html_content, self.prettify
+            ).result()
+        for name, duration in durations.items():
+            metrics.add_span(name, duration)
+        # Comments are fetched before recording the page, so that a recorded page is complete
+        self._add_comments(posts, executor_parse)
+        return self._add_page_posts(page_number, posts)
+
+    def _add_comments(
+        self, posts: list[Post], executor_parse: ProcessPoolExecutor = None
+    ):
+        """Fetch the comments of the posts of a page, if comments are archived.
+        Pages of comments of all the posts are fetched concurrently, in two batches: the first page of every post,
+        then all their next pages, whose number is only known from the first ones."""
+        if not self.archive_comments:
+            return
+        posts_commented = []
+        for post in posts:
+            if post.url is None or post.nb_comments == 0:
+                # No comments to fetch, the blog page tells so
+                post.comments = []
+            else:
+                posts_commented.append(post)
+        if not posts_commented:
+            return
+
+        with ThreadPoolExecutor(max_workers=self.nb_workers_comments) as executor:
+            futures_first = [
+                submit_in_context(
+                    executor, _get_comments_page, post.url, 1, executor_parse
+                )
+                for post in posts_commented
+            ]
+            # The next pages of a post are requested as soon as its first page is parsed
+            futures_next = []
+            for post, future in zip(posts_commented, futures_first):
+                post.comments, nb_pages = future.result()
+                futures_next.append(
+                    [
+                        submit_in_context(
+                            executor, _get_comments_page, post.url, page_number, executor_parse
+                        )
+                        for page_number in range(2, nb_pages + 1)
+                    ]
+                )
+            for post, futures in zip(posts_commented, futures_next):
+                for future in futures:
+                    post.comments.extend(future.result()[0])
+        metrics.count(
+            "comments_fetched", sum(len(post.comments) for post in posts_commented)
+        )
+
+    def _add_page_posts(self, page_number: int, posts: list[Post]) -> list[Post]:
+        """Record the posts of a freshly fetched page into the manifest, if any"""
+        metrics.count("posts_fetched", len(posts))
+        if self.manifest is not None:
+            self.manifest.add_page(page_number, posts)
         return posts
 
     @staticmethod
@@ -106,10 +312,11 @@ class SkyblogReader:
 
     @staticmethod
     def get_url_profile_picture(soup: BeautifulSoup, username: str) -> str:
-        logger.debug(f'Requesting URL "https://{username}.skyrock.com/photo.html"')
-        response = requests.get(f"https://{username}.skyrock.com/photo.html")
+        url = f"{get_url_blog(username)}/photo.html"
+        logger.debug(f'Requesting URL "{url}"')
+        response = http_client.get(url)
 
-        picture_soup = BeautifulSoup(response.text, "html.parser")
+        picture_soup = make_soup(response.text, parse_only=STRAINER_PROFILE_PICTURE)
         url_picture = picture_soup.find("img", id="laphoto")["src"]
         if not url_picture:
             # No profile picture found, fallback to skyblog avatar
@@ -127,88 +334,6 @@ class SkyblogReader:
         max_page = all_pages[-2].get_text().replace(".", "").strip()
         return int(max_page)
 
-    @staticmethod
-    def get_color_block_title(soup: BeautifulSoup) -> str:
-        color = "000000"  # Default color, black
-
-        # There is either a pasted CSS content in a style tag called "template_css_perso", or a file in a
-        # link called "template_css"
-        style = soup.find("style", id="template_css_perso")
-        if style:
-            style = str(style.contents[0]).split("\n")[1]
-            style = CSS21Parser().parse_stylesheet(style)
-            for rule in style.rules:
-                if ".bloc_title" in str(rule):
-                    for declaration in rule.declarations:
-                        if " color:" in str(declaration):
-                            color = str(declaration.value[0].value)
-                            break
-        else:
-            # Fetch CSS file
-            url_css = soup.find("link", id="template_css")["href"]
-            style = CSS21Parser().parse_stylesheet(requests.get(url_css).text)
-            for rule in style.rules:
-                if ".bloc_title" in str(rule) and " background:" in str(
-                    rule.declarations
-                ):
-                    color = rule.declarations[0].value[0].value[1:]
-                    break
-
-        if color[0] == "#":
-            color = color[1:]
-        return color
-
-    @staticmethod
-    def get_color_text_title(soup: BeautifulSoup) -> str:
-        color = "fff"  # Default color, white
-
-        # There is either a pasted CSS content in a style tag called "template_css_perso", or a file in a
-        # link called "template_css"
-        style = soup.find("style", id="template_css_perso")
-        if style:
-            style = str(style.contents[0])
-            color = re.findall(r"#linkPopup\{color:#([a-fA-F0-9]{3,6})", style)
-            if not color:
-                # No posts, blog is empty
-                return ""
-            color = color[0]
-        else:
-            # Fetch CSS file
-            url_css = soup.find("link", id="template_css")["href"]
-            style = CSS21Parser().parse_stylesheet(requests.get(url_css).text)
-            for rule in style.rules:
-                if ".bloc_title" in str(rule) and " color:" in str(rule.declarations):
-                    color = rule.declarations[0].value[0].value[1:]
-                    break
-        return color
-
-    @staticmethod
-    def get_color_articles_background(soup: BeautifulSoup) -> str:
-        color = "ffffff"  # Default color, white
-
-        # There is either a pasted CSS content in a style tag called "template_css_perso", or a file in a
-        # link called "template_css"
-        style = soup.find("style", id="template_css_perso")
-        if style:
-            style = str(style.contents[0])
-            color = re.findall(
-                r"#promos_ads\{color:#[a-fA-F0-9]{3,6};background-color:#([a-fA-F0-9]{3,6})",
-                style,
-            )
-            if not color:
-                # No posts, blog is empty
-                return ""
-            color = color[0]
-        else:
-            # Fetch CSS file
-            url_css = soup.find("link", id="template_css")["href"]
-            style = CSS21Parser().parse_stylesheet(requests.get(url_css).text)
-            for rule in style.rules:
-                if ".bloc," in str(rule) and "background" in str(rule.declarations):
-                    color = rule.declarations[0].value[0].value[1:]
-                    break
-        return color
-
     @staticmethod
     def get_background_picture_url(soup: BeautifulSoup) -> str | None:
         style = soup.find("body")
@@ -221,69 +346,76 @@ class SkyblogReader:
         url = url[:-2]  # Remove ");" at the end of the url
         return url
 
-    @staticmethod
-    def get_color_background(soup: BeautifulSoup) -> str | None:
-        color = "ffffff"  # Default color, white
-
-        # There is either a pasted CSS content in a style tag called "template_css_perso", or a file in a
-        # link called "template_css"
-        style = soup.find("style", id="template_css_perso")
-        if style:
-            style = str(style.contents[0])
-            color = re.findall(
-                r"body\{background-color:#([a-fA-F0-9]{3,6})",
-                style,
+
+def parse_page_posts(
+    html_content: str, prettify: bool = False
+) -> tuple[list[Post], dict[str, float]]:
+    """Parse the posts of a page. Can run in a process worker, thus returns the durations of the parsing stages
+    instead of recording them."""
+    start = time.perf_counter()
+    soup = make_soup(html_content, parse_only=STRAINER_ARTICLES)
+    parsed = time.perf_counter()
+    posts = _html_to_post(soup, prettify=prettify)
+    return posts, {
+        "reader.parse_page": parsed - start,
+        "reader.extract_posts": time.perf_counter() - parsed,
+    }
+
+
+def _get_comments_page(
+    url_post: str, page_number: int, executor_parse: ProcessPoolExecutor = None
+) -> tuple[list[Comment], int]:
+    """Fetch and parse a page of comments of a post. Return its comments, and the number of pages of comments."""
+    html_content = request_comments_page(url_post, page_number)
+    if html_content is None:
+        return [], 1
+    if executor_parse is None:
+        comments, nb_pages, durations = parse_comments_page(html_content)
+    else:
+        comments, nb_pages, durations = executor_parse.submit(
+            parse_comments_page, html_content
+        ).result()
+    for name, duration in durations.items():
+        metrics.add_span(name, duration)
+    return comments, nb_pages
+
+
+def parse_comments_page(
+    html_content: str,
+) -> tuple[list[Comment], int, dict[str, float]]:
+    """Parse a page of comments of a post, and the number of pages of comments. Can run in a process worker, as
+    `parse_page_posts`."""
+    start = time.perf_counter()
+    soup = make_soup(html_content, parse_only=STRAINER_COMMENTS)
+    parsed = time.perf_counter()
+    comments = _html_to_comments(soup)
+    nb_pages = SkyblogReader.get_highest_page_number(soup)
+    return comments, nb_pages, {
+        "reader.parse_comments": parsed - start,
+        "reader.extract_comments": time.perf_counter() - parsed,
+    }
+
+
+def _html_to_comments(soup: BeautifulSoup) -> list[Comment]:
+    comments = []
+    for item in soup.find_all("li", class_="comment"):
+        text_container = item.find("div", class_="comment_text")
+        if text_container is None:
+            continue
+        _sanitize(text_container)
+        author = item.find(class_="author")
+        date = item.find("time")
+        comments.append(
+            Comment(
+                author=author.get_text().strip() if author is not None else "",
+                date=date.get_text().strip() if date is not None else "",
+                text=text_container.decode_contents().strip(),
             )
-            if not color:
-                # No posts, blog is empty
-                return ""
-            color = color[0]
-        else:
-            # Fetch CSS file
-            url_css = soup.find("link", id="template_css")["href"]
-            style = CSS21Parser().parse_stylesheet(requests.get(url_css).text)
-            for rule in style.rules:
-                if ".consult," in str(rule) and " background:" in str(
-                    rule.declarations
-                ):
-                    color = rule.declarations[0].value[0].value[1:]
-                    break
-        return color
+        )
+    return comments
 
-    @staticmethod
-    def get_color_theme(soup: BeautifulSoup) -> str | None:
-        color = "000000"  # Default color, black
-
-        # There is either a pasted CSS content in a style tag called "template_css_perso", or a file in a
-        # link called "template_css"
-        style = soup.find("style", id="template_css_perso")
-        if style:
-            style = str(style.contents[0]).split("\n")[1]
-            style = CSS21Parser().parse_stylesheet(style)
-            for rule in style.rules:
-                if ".bloc-description" in str(rule):
-                    for declaration in rule.declarations:
-                        if "background-color" in str(declaration):
-                            color = str(declaration.value[0].value)
-                            break
-                    break
-        else:
-            # Fetch CSS file
-            url_css = soup.find("link", id="template_css")["href"]
-            style = CSS21Parser().parse_stylesheet(requests.get(url_css).text)
-            for rule in style.rules:
-                if ".bloc-description" in str(rule) and " background:" in str(
-                    rule.declarations
-                ):
-                    color = str(rule.declarations[0].value[0].value)
-                    break
-
-        if color[0] == "#":
-            color = color[1:]
-        return color
-
-
-def _html_to_post(soup: BeautifulSoup) -> list[Post]:
+
+def _html_to_post(soup: BeautifulSoup, prettify: bool = False) -> list[Post]:
     # Work on the articles container
     div = soup.find("div", id="articles_container")
     if not div:
@@ -295,12 +427,20 @@ def _html_to_post(soup: BeautifulSoup) -> list[Post]:
 
     posts = []
     for div in divs:
-        text = _get_post_text(div)
+        text = _get_post_text(div, prettify=prettify)
         image = _get_post_image(div)
         date = _get_post_date(div)
         title = _get_post_title(div)
 
-        post = Post(text=text, image=image, date=date, title=title)
+        post = Post(
+            text=text,
+            image=image,
+            date=date,
+            title=title,
+            id=div["id"],
+            url=_get_post_url(div),
+            nb_comments=_get_post_nb_comments(div),
+        )
         posts.append(post)
     return posts
 
@@ -309,9 +449,61 @@ def _get_post_title(soup: BeautifulSoup):
     return soup.find("a").get_text()
 
 
-def _get_post_text(soup: BeautifulSoup):
+def _get_post_url(soup: BeautifulSoup) -> str | None:
+    link = soup.find("a")
+    if link is None:
+        return None
+    return link.get("href")
+
+
+def _get_post_nb_comments(soup: BeautifulSoup) -> int | None:
+    link = soup.find("a", class_="comments")
+    if link is None:
+        return None
+    nb_comments = re.search(r"\d+", link.get_text())
+    return int(nb_comments[0]) if nb_comments is not None else 0
+
+
+def _sanitize(soup: BeautifulSoup):
+    """Keep only the allowed tags and attributes of the descendants of an element, and the URLs of allowed schemes
+    (no `javascript:` nor `data:`), so that the text can be inserted as HTML in the archive pages"""
+    for tag in soup.find_all(True):
+        if tag.decomposed:
+            # Descendant of a dropped element
+            continue
+        if tag.name in TAGS_DROPPED:
+            tag.decompose()
+            continue
+        for name, value in list(tag.attrs.items()):
+            if name not in ATTRIBUTES_ALLOWED or (
+                name in ATTRIBUTES_URL and not _is_url_allowed(value)
+            ):
+                del tag[name]
+        if tag.name not in TAGS_ALLOWED:
+            tag.unwrap()
+
+
+def _is_url_allowed(url: str) -> bool:
+    # Browsers ignore the whitespaces and control characters inside a scheme ("java\tscript:")
+    url = re.sub(r"[\x00-\x20]", "", url)
+    try:
+        return urllib.parse.urlsplit(url).scheme.lower() in SCHEMES_URL_ALLOWED
+    except ValueError:
+        return False
+
+
+def _get_post_text(soup: BeautifulSoup, prettify: bool = False) -> str | None:
     text_container = soup.find("div", class_="text-image-container")
-    return text_container
+    if text_container is None:
+        return None
+
+    # Sanitize the text: only allowed tags, attributes and URLs
+    _sanitize(text_container)
+
+    # Prettifying is slow and inflates the output, only do it on demand
+    if prettify:
+        return text_container.prettify()
+    return str(text_container)
 
 
 def _get_post_image(soup: BeautifulSoup):
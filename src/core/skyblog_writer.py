@@ -1,7 +1,33 @@
+import contextlib
+import itertools
+import json
 import os
 import shutil
+import uuid
+from collections.abc import Iterable, Iterator
 
-from common import save_picture
+from core import metrics
+from core.asset_store import AssetStore
+from core.assets import AssetDownloader
+from core.container import EXTENSION_CONTAINER, pack_directory
+from core.manifest import Manifest
+from core.minify import SUFFIXES_ENCODING, minify_css, write_compressed
+from core.post import Post
+from core.search_index import SearchIndex
+from core.template import Template, load_template
+from core.thumbnails import Thumbnailer
+
+# Directory of the static files shared by all archives, next to the users directories
+DIRNAME_STATIC = "_static"
+# Settings the static files were installed with, in their directory
+FILENAME_STATIC_SETTINGS = ".settings.json"
+# Files of the template rendered for each user, the other ones are static
+FILENAMES_TEMPLATES = ("index.html",)
+# Directory of the comments of the posts, one JSON file per post loaded on demand by the pages script
+DIRNAME_COMMENTS = "comments"
+# Directory of the shards of rendered posts, loaded by the pages script as the reader scrolls
+DIRNAME_SHARDS = "posts"
+EXTENSIONS_COMPRESSIBLE = (".html", ".css", ".js", ".json")
 
 
 class SkyblogWriter:
@@ -10,7 +36,7 @@ class SkyblogWriter:
         username: str,
         path_dir_archive_user: str,
         path_template: str,
-        articles,
+        articles: Iterable[Post],
         title: str,
         description: str,
         max_page_number: int,
@@ -21,6 +47,16 @@ class SkyblogWriter:
         color_block_title: str,
         color_text_title: str,
         color_articles_background: str,
+        store: AssetStore,
+        manifest: Manifest = None,
+        nb_workers_assets: int = 1,
+        nb_posts_per_page: int = 5,
+        nb_posts_per_shard: int = 30,
+        search_index: SearchIndex = None,
+        minify: bool = True,
+        precompress: bool = True,
+        thumbnailer: Thumbnailer = None,
+        container: bool = False,
     ):
         self.username = username
         self.path_dir_archive_user = path_dir_archive_user
@@ -36,17 +72,70 @@ class SkyblogWriter:
         self.color_block_title = color_block_title
         self.color_text_title = color_text_title
         self.color_articles_background = color_articles_background
+        self.manifest = manifest
+        self.nb_posts_per_page = max(1, nb_posts_per_page)
+        # 0 to disable the shards (and the infinite scroll)
+        self.nb_posts_per_shard = max(0, nb_posts_per_shard)
+        self.search_index = search_index
+        self.minify = minify
+        self.precompress = precompress
+        self.thumbnailer = thumbnailer
+        self.container = container
+        self.path_file_container = path_dir_archive_user + EXTENSION_CONTAINER
+        self.assets = AssetDownloader(
+            path_dir_archive_user=path_dir_archive_user,
+            store=store,
+            nb_workers=nb_workers_assets,
+            manifest=manifest,
+        )
 
     def archive(self):
-        self.init_template()
+        with metrics.span("writer.template"):
+            self.init_template()
         self.save_background_picture()
         self.save_profile_picture()
+        with metrics.span("writer.assets"):
+            self.assets.download_all()
         self.fill_index_html()
+        if self.container:
+            with metrics.span("writer.container"):
+                self.pack()
 
     def init_template(self):
-        """Copy the template folder"""
-        shutil.copytree(
-            self.path_template, self.path_dir_archive_user, dirs_exist_ok=True
+        """Create the archive folder, the template static files being shared by all archives"""
+        os.makedirs(self.path_dir_archive_user, exist_ok=True)
+        if not self.container and os.path.exists(self.path_file_container):
+            # Packed by a previous run, it would be served instead of the directory
+            os.remove(self.path_file_container)
+        install_static(
+            self.path_template,
+            os.path.join(os.path.dirname(self.path_dir_archive_user), DIRNAME_STATIC),
+            minify=self.minify,
+            precompress=self.precompress,
+        )
+
+    def pack(self):
+        """Pack the written archive into a single container file, next to the user directory. Only the manifest (and
+        its journal and the posts records) are kept in the directory, to resume or skip the user on the next runs.
+        Pictures of the store are not packed, which would copy them once per user: the container links them."""
+        links = {}
+        if self.manifest is not None:
+            path_dir_container = os.path.dirname(self.path_file_container)
+            for path_relative, asset in self.manifest.assets.items():
+                path_object = self.assets.store.get_path_object(asset["sha256"])
+                if os.path.exists(path_object):
+                    links[path_relative.replace(os.sep, "/")] = os.path.relpath(
+                        path_object, path_dir_container
+                    ).replace(os.sep, "/")
+        pack_directory(
+            self.path_dir_archive_user,
+            self.path_file_container,
+            filenames_kept=(
+                Manifest.FILENAME,
+                Manifest.FILENAME_JOURNAL,
+                Manifest.FILENAME_POSTS,
+            ),
+            links=links,
         )
 
     def save_background_picture(self):
@@ -54,84 +143,263 @@ class SkyblogWriter:
             # No background found by the reader, skipping
             return
 
-        save_picture(
-            path_dir_output=os.path.join(self.path_dir_archive_user, "img"),
-            url=self.url_background,
-            filename="background.jpg",
-        )
+        self.assets.add(url=self.url_background, filename="background.jpg")
 
     def save_profile_picture(self):
         if self.url_profile_picture is None:
             # No profile picture found by the scrapper
             return
 
-        save_picture(
-            path_dir_output=os.path.join(self.path_dir_archive_user, "img"),
-            url=self.url_profile_picture,
-            filename="profile_picture.jpg",
-        )
+        self.assets.add(url=self.url_profile_picture, filename="profile_picture.jpg")
+
+    def save_posts_pictures(self, posts: list[Post]) -> dict[str, list]:
+        """Download the pictures of the posts. Return their thumbnails, by picture filename, if enabled."""
+        for post in posts:
+            if post.image_url is not None:
+                self.assets.add(url=post.image_url, filename=post.get_image_filename())
+        with metrics.span("writer.assets"):
+            self.assets.download_all()
+
+        if self.thumbnailer is None:
+            return {}
+        path_dir_img = os.path.join(self.path_dir_archive_user, "img")
+        filenames = [
+            post.get_image_filename()
+            for post in posts
+            if post.image_url is not None
+            and os.path.exists(os.path.join(path_dir_img, post.get_image_filename()))
+        ]
+        return self.thumbnailer.generate(path_dir_img, filenames)
 
     def fill_index_html(self):
         """
-        Replace every {{ username }} in the index.html file with the username
-        And fill the div with the id "posts" with the posts
+        Fill the index.html template with the blog information, and the div with the id "posts" with the posts,
+        writing one page per `nb_posts_per_page` posts
+        The rendered posts are also written in JSON shards of `nb_posts_per_shard` posts, from which the pages script
+        appends the next posts when scrolling, pages staying small whatever the number of posts
+        The articles are consumed as they come, so that they can be streamed from the reader
         """
-        with open(self.path_dir_archive_user + "/index.html") as fp_html:
-            html_content = fp_html.read()
-        with open(self.path_dir_archive_user + "/styles.css") as fp_css:
-            css_content = fp_css.read()
-
-        # Replace the {{ username }} with the username
-        html_content = html_content.replace("{{ username }}", self.username)
-
-        # Fill the div with the id "posts" with the posts
-        posts_html = ""
-        for post in self.articles:
-            posts_html += post.to_html(self.path_dir_archive_user)
-        html_content = html_content.replace("{{ posts }}", posts_html)
-
-        # Add the background to the body html element
-        html_content = html_content.replace(
-            "{{ path_file_background }}",
-            os.path.join(self.path_dir_archive_user, "img", "background.jpg"),
+        template_html = load_template(
+            os.path.join(self.path_template, "index.html"), minify=self.minify
         )
 
-        # Fill the background with the proper color
-        # Overwrite wallpaper, thus check beforehand if it exists
-        html_content = html_content.replace(
-            "{{ background_color }}",
-            f"background: #{self.color_background};" if not self.url_background else "",
-        )
+        context = {
+            "username": self.username,
+            # Fill the background with the proper color
+            # Overwrite wallpaper, thus check beforehand if it exists
+            "background_color": (
+                f"background: #{self.color_background};" if not self.url_background else ""
+            ),
+            # Set theme color, also given to the shared stylesheet as a CSS variable
+            "theme_color_with_attribute": f"color: #{self.color_theme}",
+            "theme_color": f"#{self.color_theme}",
+            "title": self.title,
+            "description": self.description,
+            # Fill all titles with the proper color
+            "color_block_title": self.color_block_title,
+            "color_text_title": self.color_text_title,
+            "color_articles_background": self.color_articles_background,
+        }
 
-        # Set theme color
-        html_content = html_content.replace(
-            "{{ theme_color_with_attribute }}", f"color: #{self.color_theme}"
-        )
-        html_content = html_content.replace("{{ theme_color }}", f"#{self.color_theme}")
-        css_content = css_content.replace("{{ theme_color }}", f"#{self.color_theme}")
+        # Write one HTML page per chunk of posts, as the original blog pagination
+        # Chunks are read one ahead, to know whether a next page exists
+        chunks = _iter_chunks(self.articles, self.nb_posts_per_page)
+        posts = next(chunks, [])
+        page_number = 1
+        shard = []
+        shard_number = 0
+        while True:
+            posts_next = next(chunks, None)
+            thumbnails = self.save_posts_pictures(posts)
+            with metrics.span("writer.comments"):
+                self.write_comments(posts)
+            with metrics.span("writer.render_page"):
+                posts_html = self.render_posts(posts, thumbnails)
+                self.write_page(
+                    template_html,
+                    context,
+                    posts_html=posts_html,
+                    page_number=page_number,
+                    has_next=posts_next is not None,
+                )
+            metrics.count("pages_written")
+            if self.nb_posts_per_shard > 0:
+                # A shard is written once the next post is known, to tell whether a next shard exists
+                with metrics.span("writer.shards"):
+                    for post_html in posts_html:
+                        if len(shard) == self.nb_posts_per_shard:
+                            self.write_shard(shard_number, shard, has_next=True)
+                            shard = []
+                            shard_number += 1
+                        shard.append(post_html)
+            if self.search_index is not None:
+                with metrics.span("writer.search_index"):
+                    self.search_index.add_posts(self.username, page_number, posts)
+            if posts_next is None:
+                break
+            posts = posts_next
+            page_number += 1
 
-        # Set title
-        html_content = html_content.replace("{{ title }}", self.title)
+        if self.nb_posts_per_shard > 0:
+            with metrics.span("writer.shards"):
+                self.write_shard(shard_number, shard, has_next=False)
 
-        # Set the description
-        html_content = html_content.replace("{{ description }}", self.description)
+    def write_comments(self, posts: list[Post]):
+        """Write the comments of each commented post in its own JSON file, so that pages only hold a collapsed
+        section for them, loaded when opened"""
+        for post in posts:
+            if post.comments:
+                self.write_json(
+                    os.path.join(DIRNAME_COMMENTS, post.get_comments_filename()),
+                    [comment.to_dict() for comment in post.comments],
+                )
 
-        # Fill all titles with the proper color
-        html_content = html_content.replace(
-            "{{ color_block_title }}", self.color_block_title
+    def write_shard(self, shard_number: int, posts_html: list[str], has_next: bool):
+        """Write a shard of rendered posts, the shards being numbered from the first post of the blog"""
+        self.write_json(
+            os.path.join(DIRNAME_SHARDS, f"{shard_number}.json"),
+            {"posts": posts_html, "has_next": has_next},
         )
+        metrics.count("shards_written")
 
-        # Fill all titles text with the proper color
-        html_content = html_content.replace(
-            "{{ color_text_title }}", self.color_text_title
-        )
+    def write_json(self, path_relative: str, content):
+        """Write a compact JSON file in the archive, and its compressed siblings if enabled"""
+        path_file = os.path.join(self.path_dir_archive_user, path_relative)
+        os.makedirs(os.path.dirname(path_file), exist_ok=True)
+        path_file_tmp = path_file + ".part"
+        with open(path_file_tmp, "w", encoding="utf-8") as fp:
+            json.dump(content, fp, ensure_ascii=False, separators=(",", ":"))
+        os.replace(path_file_tmp, path_file)
+        if self.precompress:
+            write_compressed(path_file)
+
+    def render_posts(
+        self, posts: list[Post], thumbnails: dict[str, list] = None
+    ) -> list[str]:
+        """Render the posts with the blog colors"""
+        thumbnails = thumbnails or {}
+        return [
+            post.to_html(
+                color_articles_background=self.color_articles_background,
+                color_block_title=self.color_block_title,
+                color_text_title=self.color_text_title,
+                thumbnails=thumbnails.get(post.get_image_filename()),
+            )
+            for post in posts
+        ]
 
-        # Fill all articles background with the proper color
-        html_content = html_content.replace(
-            "{{ color_articles_background }}", self.color_articles_background
+    def write_page(
+        self,
+        template_html: Template,
+        context: dict,
+        posts_html: list[str],
+        page_number: int,
+        has_next: bool,
+    ):
+        """Fill the template with the rendered posts of a page, and write it in a single pass"""
+        # Where the pages script continues from when scrolling, the next page first post
+        posts_attributes = ""
+        if self.nb_posts_per_shard > 0 and has_next:
+            posts_attributes = (
+                f' data-shard-size="{self.nb_posts_per_shard}"'
+                f' data-next-post="{page_number * self.nb_posts_per_page}"'
+            )
+        path_file = os.path.join(
+            self.path_dir_archive_user, get_page_filename(page_number)
+        )
+        template_html.render_to_file(
+            path_file,
+            {
+                **context,
+                "posts": posts_html,
+                "posts_attributes": posts_attributes,
+                # Add the navigation between pages
+                "pagination": get_pagination_html(page_number, has_next),
+            },
         )
+        if self.precompress:
+            with metrics.span("writer.compress"):
+                write_compressed(path_file)
+
+
+def install_static(
+    path_template: str, path_dir_static: str, minify: bool = True, precompress: bool = True
+):
+    """Install the static files of the template (stylesheet, scripts, icons) once for all archives, minified and
+    pre-compressed. A file is only installed again when the template one is more recent, or when the settings changed
+    since the last install (all the files are installed again then)."""
+    settings = {"minify": minify, "precompress": precompress}
+    path_file_settings = os.path.join(path_dir_static, FILENAME_STATIC_SETTINGS)
+    try:
+        with open(path_file_settings) as fp:
+            reinstall = json.load(fp) != settings
+    except (FileNotFoundError, ValueError):
+        # First install, or installed before the settings were recorded
+        reinstall = True
+
+    for path_dir, _, filenames in os.walk(path_template):
+        for filename in filenames:
+            path_file = os.path.join(path_dir, filename)
+            path_relative = os.path.relpath(path_file, path_template)
+            if path_relative in FILENAMES_TEMPLATES:
+                continue
+            path_file_static = os.path.join(path_dir_static, path_relative)
+            if (
+                not reinstall
+                and os.path.exists(path_file_static)
+                and os.path.getmtime(path_file_static) >= os.path.getmtime(path_file)
+            ):
+                continue
+
+            os.makedirs(os.path.dirname(path_file_static), exist_ok=True)
+            # Unique temporary name, concurrent workers can install the files at the same time
+            path_file_tmp = f"{path_file_static}.{uuid.uuid4().hex}.part"
+            if minify and filename.endswith(".css"):
+                with open(path_file) as fp:
+                    css_content = fp.read()
+                with open(path_file_tmp, "w") as fp:
+                    fp.write(minify_css(css_content))
+            else:
+                shutil.copyfile(path_file, path_file_tmp)
+            os.replace(path_file_tmp, path_file_static)
+            if precompress and filename.endswith(EXTENSIONS_COMPRESSIBLE):
+                write_compressed(path_file_static)
+            else:
+                # Compressed siblings of a previous install would be served instead
+                for suffix in SUFFIXES_ENCODING.values():
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(path_file_static + suffix)
+
+    if reinstall:
+        os.makedirs(path_dir_static, exist_ok=True)
+        path_file_tmp = f"{path_file_settings}.{uuid.uuid4().hex}.part"
+        with open(path_file_tmp, "w") as fp:
+            json.dump(settings, fp)
+        os.replace(path_file_tmp, path_file_settings)
+
+
+def get_page_filename(page_number: int) -> str:
+    """The first page is the index, the next ones are named after their number, as on skyrock"""
+    if page_number == 1:
+        return "index.html"
+    return f"{page_number}.html"
+
+
+def get_pagination_html(page_number: int, has_next: bool) -> str:
+    if page_number == 1 and not has_next:
+        return ""
+
+    html_content = '<nav class="pagination">'
+    if page_number > 1:
+        html_content += f'<a class="previous" href="{get_page_filename(page_number - 1)}">&laquo; Previous</a>'
+    html_content += f'<span class="current">{page_number}</span>'
+    if has_next:
+        html_content += f'<a class="next" href="{get_page_filename(page_number + 1)}">Next &raquo;</a>'
+    html_content += "</nav>"
+    return html_content
+
 
-        with open(self.path_dir_archive_user + "/index.html", "w") as fp_html:
-            fp_html.write(html_content)
-        with open(self.path_dir_archive_user + "/styles.css", "w") as fp_css:
-            fp_css.write(css_content)
+def _iter_chunks(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
@@ -0,0 +1,64 @@
+import functools
+import os
+import re
+from collections.abc import Iterable
+from typing import TextIO
+
+from core.minify import minify_html
+
+PATTERN_SLOT = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+
+
+class Template(object):
+    """
+    Template compiled once into static chunks and `{{ name }}` slots.
+    Rendering writes the chunks and the slots values in a single pass into a file, without ever building (or copying)
+    the whole output in memory. A slot value is either a string, or an iterable of strings which is consumed while
+    writing (e.g. a generator rendering posts one by one). Slots missing from the context are left as is.
+    """
+
+    def __init__(self, text: str):
+        self.parts = []
+        position = 0
+        for match in PATTERN_SLOT.finditer(text):
+            if match.start() > position:
+                self.parts.append((False, text[position : match.start()]))
+            self.parts.append((True, match.group(1)))
+            position = match.end()
+        if position < len(text):
+            self.parts.append((False, text[position:]))
+
+    @property
+    def slots(self) -> set[str]:
+        return {value for is_slot, value in self.parts if is_slot}
+
+    def render(self, fp: TextIO, context: dict[str, str | Iterable[str]]):
+        for is_slot, value in self.parts:
+            if not is_slot:
+                fp.write(value)
+            elif value not in context:
+                fp.write(f"{{{{ {value} }}}}")
+            elif isinstance(context[value], str):
+                fp.write(context[value])
+            else:
+                for chunk in context[value]:
+                    fp.write(chunk)
+
+    def render_to_file(self, path_file: str, context: dict[str, str | Iterable[str]]):
+        with open(path_file, "w") as fp:
+            self.render(fp, context)
+
+
+@functools.lru_cache(maxsize=32)
+def _load_template(path_file: str, mtime: float, minify: bool) -> Template:
+    with open(path_file) as fp:
+        text = fp.read()
+    if minify:
+        text = minify_html(text)
+    return Template(text)
+
+
+def load_template(path_file: str, minify: bool = False) -> Template:
+    """Compile a template file, once as long as it is not modified. The static chunks of an HTML template can be
+    minified at compile time."""
+    return _load_template(path_file, os.path.getmtime(path_file), minify)
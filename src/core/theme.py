@@ -0,0 +1,203 @@
+import functools
+import re
+
+from bs4 import BeautifulSoup
+from tinycss import CSS21Parser
+
+from logger import logger
+
+from core.http_client import http_client
+
+
+class Theme(object):
+    """
+    Colors of a skyblog template
+    """
+
+    def __init__(
+        self,
+        color_background: str,
+        color_theme: str,
+        color_block_title: str,
+        color_text_title: str,
+        color_articles_background: str,
+    ):
+        self.color_background = color_background
+        self.color_theme = color_theme
+        self.color_block_title = color_block_title
+        self.color_text_title = color_text_title
+        self.color_articles_background = color_articles_background
+
+
+class StyleIndex(object):
+    """
+    Rules of a stylesheet, parsed once.
+    Each rule is a `(selector, declarations)` tuple, in the stylesheet order. A declaration is a `(name, value)` tuple
+    where the value is the first token of the declaration.
+    """
+
+    def __init__(self, stylesheet: str):
+        self.rules = []
+        for rule in CSS21Parser().parse_stylesheet(stylesheet).rules:
+            if not hasattr(rule, "selector"):
+                # At-rules have no selector
+                continue
+            declarations = [
+                (
+                    declaration.name,
+                    str(declaration.value[0].value) if declaration.value else "",
+                )
+                for declaration in rule.declarations
+            ]
+            self.rules.append((rule.selector.as_css(), declarations))
+
+    def find(self, selector: str):
+        """Iterate through the declarations of all rules whose selector contains `selector`, in the stylesheet
+        order."""
+        for selector_rule, declarations in self.rules:
+            if selector in selector_rule:
+                yield declarations
+
+
+@functools.lru_cache(maxsize=256)
+def get_style_index(url_css: str) -> StyleIndex:
+    """Fetch and index a template CSS file. Stock skyrock templates are shared by many blogs, so indexes are cached
+    across users, keyed by URL. Raise `requests.HTTPError` on an error response (e.g. still throttled after the
+    retries), so that an error page is never parsed into default colors, nor cached."""
+    logger.debug(f'Requesting CSS "{url_css}"')
+    response = http_client.get(url_css)
+    response.raise_for_status()
+    return StyleIndex(response.text)
+
+
+def extract_theme(soup: BeautifulSoup) -> Theme:
+    """Extract all the template colors of a blog from its first page.
+    There is either a pasted CSS content in a style tag called "template_css_perso", or a file in a link called
+    "template_css". Either way, the stylesheet is fetched and parsed only once.
+    """
+    style = soup.find("style", id="template_css_perso")
+    if style:
+        style = str(style.contents[0])
+        lines = style.split("\n")
+        style_index = StyleIndex(lines[1] if len(lines) > 1 else style)
+        return Theme(
+            color_background=_get_color_background_perso(style),
+            color_theme=_get_color_theme_perso(style_index),
+            color_block_title=_get_color_block_title_perso(style_index),
+            color_text_title=_get_color_text_title_perso(style),
+            color_articles_background=_get_color_articles_background_perso(style),
+        )
+
+    style_index = get_style_index(soup.find("link", id="template_css")["href"])
+    return Theme(
+        color_background=_get_color_background(style_index),
+        color_theme=_get_color_theme(style_index),
+        color_block_title=_get_color_block_title(style_index),
+        color_text_title=_get_color_text_title(style_index),
+        color_articles_background=_get_color_articles_background(style_index),
+    )
+
+
+def _get_color_block_title_perso(style_index: StyleIndex) -> str:
+    color = "000000"  # Default color, black
+    # The last rule setting a color wins
+    for declarations in style_index.find(".bloc_title"):
+        value = _get_declaration(declarations, "color")
+        if value is not None:
+            color = value
+    return _strip_hash(color)
+
+
+def _get_color_text_title_perso(style: str) -> str:
+    color = re.findall(r"#linkPopup\{color:#([a-fA-F0-9]{3,6})", style)
+    if not color:
+        # No posts, blog is empty
+        return ""
+    return color[0]
+
+
+def _get_color_articles_background_perso(style: str) -> str:
+    color = re.findall(
+        r"#promos_ads\{color:#[a-fA-F0-9]{3,6};background-color:#([a-fA-F0-9]{3,6})",
+        style,
+    )
+    if not color:
+        # No posts, blog is empty
+        return ""
+    return color[0]
+
+
+def _get_color_background_perso(style: str) -> str:
+    color = re.findall(r"body\{background-color:#([a-fA-F0-9]{3,6})", style)
+    if not color:
+        # No posts, blog is empty
+        return ""
+    return color[0]
+
+
+def _get_color_theme_perso(style_index: StyleIndex) -> str:
+    color = "000000"  # Default color, black
+    for declarations in style_index.find(".bloc-description"):
+        value = _get_declaration(declarations, "background-color")
+        if value is not None:
+            color = value
+        break
+    return _strip_hash(color)
+
+
+def _get_color_block_title(style_index: StyleIndex) -> str:
+    color = "000000"  # Default color, black
+    for declarations in style_index.find(".bloc_title"):
+        if _get_declaration(declarations, "background") is not None:
+            color = declarations[0][1]
+            break
+    return _strip_hash(color)
+
+
+def _get_color_text_title(style_index: StyleIndex) -> str:
+    color = "fff"  # Default color, white
+    for declarations in style_index.find(".bloc_title"):
+        if _get_declaration(declarations, "color") is not None:
+            color = declarations[0][1]
+            break
+    return _strip_hash(color)
+
+
+def _get_color_articles_background(style_index: StyleIndex) -> str:
+    color = "ffffff"  # Default color, white
+    for declarations in style_index.find(".bloc,"):
+        if any("background" in name for name, _ in declarations):
+            color = declarations[0][1]
+            break
+    return _strip_hash(color)
+
+
+def _get_color_background(style_index: StyleIndex) -> str:
+    color = "ffffff"  # Default color, white
+    for declarations in style_index.find(".consult,"):
+        if _get_declaration(declarations, "background") is not None:
+            color = declarations[0][1]
+            break
+    return _strip_hash(color)
+
+
+def _get_color_theme(style_index: StyleIndex) -> str:
+    color = "000000"  # Default color, black
+    for declarations in style_index.find(".bloc-description"):
+        if _get_declaration(declarations, "background") is not None:
+            color = declarations[0][1]
+            break
+    return _strip_hash(color)
+
+
+def _get_declaration(declarations: list[tuple[str, str]], name: str) -> str | None:
+    for declaration_name, value in declarations:
+        if declaration_name == name:
+            return value
+    return None
+
+
+def _strip_hash(color: str) -> str:
+    if color.startswith("#"):
+        return color[1:]
+    return color
@@ -0,0 +1,114 @@
+""" Thumbnails of the posts pictures.
+Resized variants of the downloaded pictures are created in a process pool, shared by all the archived users of the
+process, and written in the "img/thumbs" folder of the archive. Originals are never modified: pages show a thumbnail
+inline (with the other widths as a `srcset`), and link the original in the lightbox.
+Requires Pillow, which is optional: without it, pages show the originals.
+"""
+
+import os
+
+from logger import logger
+
+from core import metrics
+from core.utils import get_process_executor, run_inline
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+DIRNAME_THUMBS = "thumbs"
+
+
+class Thumbnailer(object):
+    """Settings of the thumbnails, and their generation. Only holds settings, thus can be sent to process workers."""
+
+    def __init__(self, widths: list[int], webp: bool = False, nb_workers: int = 0):
+        self.widths = sorted(widths)
+        self.webp = webp
+        # 0 for as many workers as CPUs
+        self.nb_workers = nb_workers or os.cpu_count() or 1
+
+    @property
+    def available(self) -> bool:
+        return Image is not None and bool(self.widths)
+
+    def get_executor(self):
+        return get_process_executor("thumbnails", self.nb_workers)
+
+    def generate(self, path_dir_img: str, filenames: list[str]) -> dict[str, list]:
+        """Create the thumbnails of pictures of an "img" folder, concurrently.
+        Return, for each picture having thumbnails, the list of (width, path relative to the img folder)."""
+        if not self.available or not filenames:
+            return {}
+
+        executor = self.get_executor()
+        submit = executor.submit if executor is not None else run_inline
+        futures = {
+            filename: submit(
+                make_thumbnails,
+                os.path.join(path_dir_img, filename),
+                os.path.join(path_dir_img, DIRNAME_THUMBS),
+                self.widths,
+                self.webp,
+            )
+            for filename in filenames
+        }
+        thumbnails = {}
+        for filename, future in futures.items():
+            with metrics.span("writer.thumbnails"):
+                try:
+                    result = future.result()
+                except Exception as exception:
+                    logger.warning(f'Cannot create the thumbnails of "{filename}": {exception!r}')
+                    continue
+            if result:
+                thumbnails[filename] = result
+                metrics.count("thumbnails", len(result))
+        return thumbnails
+
+
+def make_thumbnails(
+    path_file: str, path_dir_thumbs: str, widths: list[int], webp: bool = False
+) -> list[tuple[int, str]]:
+    """Create the resized variants of a picture, narrower than the picture, skipping the ones already created.
+    Return the (width, path relative to the img folder) of the variants, or an empty list if the picture is too small.
+    Runs inside the process workers."""
+    name, _ = os.path.splitext(os.path.basename(path_file))
+    extension = ".webp" if webp else ".jpg"
+    mtime = os.path.getmtime(path_file)
+    os.makedirs(path_dir_thumbs, exist_ok=True)
+
+    thumbnails = []
+    with Image.open(path_file) as image:
+        if getattr(image, "is_animated", False):
+            # Keep the animations, a thumbnail would only show their first frame
+            return thumbnails
+        width_original = image.width
+        # Decode a downscaled version when possible (JPEG), much faster for large pictures
+        image.draft("RGB", (widths[-1], widths[-1] * image.height // max(1, image.width)))
+        image_width, image_height = image.size
+        image = image.convert("RGB")
+        for width in widths:
+            if width >= width_original:
+                if thumbnails:
+                    # The original is the largest variant
+                    thumbnails.append((width_original, os.path.basename(path_file)))
+                break
+            filename_thumb = f"{name}_{width}{extension}"
+            path_file_thumb = os.path.join(path_dir_thumbs, filename_thumb)
+            if not (
+                os.path.exists(path_file_thumb)
+                and os.path.getmtime(path_file_thumb) >= mtime
+            ):
+                image_thumb = image.resize(
+                    (width, max(1, image_height * width // image_width)),
+                    Image.Resampling.LANCZOS,
+                )
+                path_file_tmp = path_file_thumb + ".part"
+                image_thumb.save(
+                    path_file_tmp, format="WEBP" if webp else "JPEG", quality=80
+                )
+                os.replace(path_file_tmp, path_file_thumb)
+            thumbnails.append((width, f"{DIRNAME_THUMBS}/{filename_thumb}"))
+    return thumbnails
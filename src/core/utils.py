@@ -1,10 +1,125 @@
-import requests
+import contextvars
+import multiprocessing
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
 
 from logger import logger
 
+from core import metrics, profiling
+from core.http_client import http_client
+
+# URL of a blog, formatted with its username. Can point to a local mock server for benchmarks.
+url_base = "https://{username}.skyrock.com"
+
+# Process pools shared by all the jobs of the process, by name
+_process_executors = {}
+_process_executors_lock = threading.Lock()
+
+
+def set_url_base(url: str):
+    global url_base
+    url_base = url.rstrip("/")
+
+
+def get_url_blog(username: str) -> str:
+    return url_base.format(username=username)
+
+
+def get_url_page(username: str, page_number: int) -> str:
+    return f"{get_url_blog(username)}/{page_number}.html"
+
 
 def request_page(username: str, page_number: int) -> str:
-    url = f"https://{username}.skyrock.com/{page_number}.html"
+    """Return the content of a blog page. Raise `requests.HTTPError` on an error page (e.g. still throttled after
+    the retries), so that it is never archived, nor recorded as fetched in the manifest."""
+    url = get_url_page(username, page_number)
     logger.debug(f"Requesting page {url}")
-    response = requests.get(url)
+    with metrics.span("reader.fetch_page"):
+        response = http_client.get(url)
+    response.raise_for_status()
+    metrics.count("pages_fetched")
+    return response.text
+
+
+def get_url_comments(url_post: str, page_number: int) -> str:
+    """The first page of comments is the post page itself"""
+    if page_number == 1:
+        return url_post
+    return f"{url_post}?page={page_number}"
+
+
+def request_comments_page(url_post: str, page_number: int) -> str | None:
+    """Return the content of a page of comments of a post, or None if the post does not exist anymore (or is missing
+    from the page cache when replaying). Raise `requests.HTTPError` on other error pages."""
+    url = get_url_comments(url_post, page_number)
+    logger.debug(f"Requesting comments {url}")
+    with metrics.span("reader.fetch_comments"):
+        response = http_client.get(url)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    metrics.count("comment_pages_fetched")
     return response.text
+
+
+def submit_in_context(executor: Executor, fn, *args, **kwargs) -> Future:
+    """Submit a call to an executor, running it in a copy of the current context so that the per-job counters
+    follow the work to the worker threads (and their profiling, see `profiling.run`)."""
+    context = contextvars.copy_context()
+    return executor.submit(context.run, profiling.run, fn, *args, **kwargs)
+
+
+def get_process_settings() -> dict:
+    """Settings of this process that the process workers must apply, see `new_process_executor`"""
+    return {"url_base": url_base, "http_client": http_client.get_settings()}
+
+
+def init_process_worker(settings: dict):
+    set_url_base(settings["url_base"])
+    http_client.apply_settings(settings["http_client"])
+
+
+def new_process_executor(nb_workers: int) -> ProcessPoolExecutor:
+    """Create a process pool whose workers apply the current settings of this process (URL base, HTTP client).
+    Forked workers would inherit them, but spawned ones (the default start method on macOS and Windows) start
+    from the configuration defaults."""
+    return ProcessPoolExecutor(
+        max_workers=nb_workers,
+        initializer=init_process_worker,
+        initargs=(get_process_settings(),),
+    )
+
+
+def get_process_executor(name: str, nb_workers: int) -> ProcessPoolExecutor | None:
+    """Return the process pool of the given name, shared by all the jobs of the process, creating it on first use.
+    All the workers are started right away: create the pools from the main thread, before starting worker threads, as
+    forking a multi-threaded process can deadlock the children (see `Archiver.start_process_pools`).
+    Return None inside a process worker (e.g. of the scheduler), where jobs already run in parallel processes, and a
+    nested pool would keep the worker from exiting: work is then done inline, see `run_inline`.
+    """
+    if multiprocessing.parent_process() is not None:
+        return None
+    with _process_executors_lock:
+        executor = _process_executors.get(name)
+        if executor is None:
+            executor = new_process_executor(nb_workers)
+            start_process_workers(executor)
+            _process_executors[name] = executor
+        return executor
+
+
+def start_process_workers(executor: ProcessPoolExecutor):
+    """Fork all the workers of a process pool now, rather than on demand from the threads submitting tasks.
+    With the "fork" start method, the first submission forks all the workers at once, before starting the management
+    threads of the pool; wait for it, so that a pool failing to start fails here."""
+    executor.submit(int).result()
+
+
+def run_inline(fn, *args) -> Future:
+    """Run a call right away, returning its future, in place of an executor `submit`"""
+    future = Future()
+    try:
+        future.set_result(fn(*args))
+    except Exception as exception:
+        future.set_exception(exception)
+    return future
@@ -11,6 +11,7 @@ from logger import logger
 
 import configparser
 import logging
+import multiprocessing
 import os
 
 from pathlib import Path
@@ -50,7 +51,11 @@ format_logging = logging.Formatter(
 
 # Set up handlers
 ## File handler
-handler_file = logging.FileHandler(filename=path_file_log, mode="w")
+# Process workers importing this module again (when spawned) append to the log of the main process
+handler_file = logging.FileHandler(
+    filename=path_file_log,
+    mode="w" if multiprocessing.parent_process() is None else "a",
+)
 handler_file.setLevel(logging.DEBUG)
 handler_file.setFormatter(format_logging)
 logger.addHandler(hdlr=handler_file)
@@ -0,0 +1,316 @@
+import csv
+import json
+import os
+import time
+import tracemalloc
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+
+from archiver import Archiver
+from core import metrics, profiling
+from core.http_client import HttpStats, http_client
+from core.utils import new_process_executor, start_process_workers
+from logger import logger
+
+STATUS_ARCHIVED = "archived"
+STATUS_MISSING = "missing"
+STATUS_FAILED = "failed"
+
+# Duration, network statistics and metrics of the probe of a user, accounted in its result
+Probe = tuple[float, HttpStats, metrics.Metrics]
+
+FIELDNAMES_SUMMARY = [
+    "username",
+    "status",
+    "duration",
+    "requests",
+    "bytes",
+    "retries",
+    "memory_peak",
+    "error",
+]
+
+
+class Scheduler(object):
+    """Scheduler class
+    Archive many users concurrently, using either thread or process workers. A failing user is reported in the
+    summary file and does not stop the batch.
+    Once done, a JSON report holds the stages durations, counters and network statistics of every user, and their
+    aggregate.
+    Users are first probed concurrently, with a single request of their first page: missing users never take a
+    worker, and the first page of the other ones is handed to their job.
+    """
+
+    def __init__(
+        self,
+        archiver: Archiver,
+        nb_workers: int,
+        executor: str,
+        path_file_summary: str,
+        path_file_report: str = None,
+        path_dir_profiles: str = None,
+        trace_memory: bool = False,
+        nb_workers_probe: int = 8,
+    ):
+        if executor not in ("thread", "process"):
+            raise ValueError(f'Unknown executor "{executor}".')
+        if path_dir_profiles is not None and executor == "thread":
+            # Profilers of jobs running concurrently in the same process would clash, or mix their threads
+            logger.warning("Profiling the users, which requires the process executor")
+            executor = "process"
+        self.archiver = archiver
+        self.nb_workers = max(1, nb_workers)
+        self.executor = executor
+        self.path_file_summary = path_file_summary
+        self.path_file_report = path_file_report
+        self.path_dir_profiles = path_dir_profiles
+        self.trace_memory = trace_memory
+        self.nb_workers_probe = max(1, nb_workers_probe)
+
+    def run(self, usernames: Iterable[str]) -> list[dict]:
+        """Archive all the given users and write the summary file. Return the results of every user."""
+        if self.executor == "process":
+            # Limits are enforced within each process: the workers and this one, probing the users, take an equal
+            # share of them
+            http_client.share_limits(self.nb_workers + 1)
+            executor = new_process_executor(self.nb_workers)
+            # Fork the workers before starting the probing threads, a child forked while a thread holds a lock
+            # (e.g. of the connection pool) would deadlock
+            start_process_workers(executor)
+        else:
+            executor = ThreadPoolExecutor(max_workers=self.nb_workers)
+            # Start the pools shared by the threads; process workers work inline, and would only leave them idle
+            self.archiver.start_process_pools()
+
+        for path_file in (self.path_file_summary, self.path_file_report):
+            if path_file is not None and os.path.dirname(path_file):
+                os.makedirs(os.path.dirname(path_file), exist_ok=True)
+        if self.path_dir_profiles is not None:
+            os.makedirs(self.path_dir_profiles, exist_ok=True)
+
+        start = time.perf_counter()
+        results = []
+        executor_probe = ThreadPoolExecutor(max_workers=self.nb_workers_probe)
+        with executor, executor_probe, open(
+            self.path_file_summary, "w", newline=""
+        ) as fp_summary:
+            writer = csv.DictWriter(
+                fp_summary, fieldnames=FIELDNAMES_SUMMARY, extrasaction="ignore"
+            )
+            writer.writeheader()
+
+            # Keep a bounded number of pending jobs, the list of users can be very long
+            pending = set()
+            for username, exists, html_first_page, probe in self._iter_probes(
+                usernames, executor_probe
+            ):
+                if not exists:
+                    logger.warning(f"User does not exists {username}")
+                    self._on_result(
+                        get_result(username, STATUS_MISSING, *probe),
+                        results,
+                        writer,
+                        fp_summary,
+                    )
+                    continue
+                if len(pending) >= 2 * self.nb_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._on_done(future, results, writer, fp_summary)
+                pending.add(
+                    executor.submit(
+                        archive_user,
+                        self.archiver,
+                        username,
+                        self.path_dir_profiles,
+                        self.trace_memory,
+                        html_first_page,
+                        probe,
+                    )
+                )
+            for future in as_completed(pending):
+                self._on_done(future, results, writer, fp_summary)
+
+        duration = time.perf_counter() - start
+        if self.path_file_report is not None:
+            self.write_report(results, duration)
+
+        nb_archived = sum(result["status"] == STATUS_ARCHIVED for result in results)
+        logger.info(
+            f"Archived {nb_archived}/{len(results)} user(s) in {duration:.1f}s, "
+            f"summary written to {self.path_file_summary}"
+        )
+        return results
+
+    def write_report(self, results: list[dict], duration: float):
+        """Write the machine-readable report of the run: every user, and their aggregate"""
+        aggregate = metrics.merge([result["metrics"] for result in results])
+        aggregate["duration"] = round(duration, 3)
+        aggregate["users"] = {
+            status: sum(result["status"] == status for result in results)
+            for status in (STATUS_ARCHIVED, STATUS_MISSING, STATUS_FAILED)
+        }
+        for key in ("requests", "bytes", "retries", "errors", "cache_hits"):
+            aggregate[key] = sum(result["http"][key] for result in results)
+        # Limits of the main process, the ones of the process workers (each one enforcing the same share of the
+        # configured limits) are in their users results
+        aggregate["limits"] = http_client.get_limits()
+        if self.trace_memory:
+            aggregate["memory_peak"] = max(
+                (
+                    result["memory_peak"]
+                    for result in results
+                    if result["memory_peak"] != ""
+                ),
+                default=0,
+            )
+
+        with open(self.path_file_report, "w") as fp:
+            json.dump({"aggregate": aggregate, "users": results}, fp, indent=2)
+        logger.info(f"Report written to {self.path_file_report}")
+
+    def _iter_probes(
+        self, usernames: Iterable[str], executor_probe: ThreadPoolExecutor
+    ) -> Iterator[tuple[str, bool, str | None, Probe]]:
+        """Probe the users concurrently, a bounded number ahead. Yield, in order, each username, whether it exists, its
+        first page if fetched, and the duration, network statistics and metrics of the probe."""
+        window = deque()
+        for username in usernames:
+            window.append(
+                (username, executor_probe.submit(probe_user, self.archiver, username))
+            )
+            if len(window) >= 2 * self.nb_workers_probe:
+                yield _get_probe(*window.popleft())
+        while window:
+            yield _get_probe(*window.popleft())
+
+    @classmethod
+    def _on_done(cls, future: Future, results: list[dict], writer: csv.DictWriter, fp):
+        cls._on_result(future.result(), results, writer, fp)
+
+    @staticmethod
+    def _on_result(result: dict, results: list[dict], writer: csv.DictWriter, fp):
+        results.append(result)
+        writer.writerow(result)
+        fp.flush()
+
+        message = (
+            f'[{len(results)}] User "{result["username"]}" {result["status"]} '
+            f'in {result["duration"]:.1f}s ({result["bytes"]} byte(s))'
+        )
+        if result["status"] == STATUS_FAILED:
+            logger.error(f'{message}: {result["error"]}')
+        else:
+            logger.info(message)
+
+
+def probe_user(
+    archiver: Archiver, username: str
+) -> tuple[bool, str | None, Probe]:
+    start = time.perf_counter()
+    with http_client.track() as stats, metrics.track() as metrics_probe:
+        exists, html_first_page = archiver.probe_user(username)
+    return exists, html_first_page, (time.perf_counter() - start, stats, metrics_probe)
+
+
+def _get_probe(username: str, future: Future) -> tuple[str, bool, str | None, Probe]:
+    try:
+        exists, html_first_page, probe = future.result()
+    except Exception as exception:
+        # Left to the job, which will retry and report the failure
+        logger.debug(f'Failed to probe user "{username}": {exception!r}')
+        return username, True, None, (0.0, None, None)
+    return username, exists, html_first_page, probe
+
+
+def archive_user(
+    archiver: Archiver,
+    username: str,
+    path_dir_profiles: str = None,
+    trace_memory: bool = False,
+    html_first_page: str = None,
+    probe: Probe = None,
+) -> dict:
+    """Archive a single user, catching any failure. Runs inside the workers.
+    The duration, requests and metrics of the `probe` that fetched `html_first_page` are added to the ones of the job.
+    If `path_dir_profiles` is given, the job is profiled with cProfile into "<username>.prof", which requires jobs to
+    run in their own process (see `profiling`). If `trace_memory` is
+    set, the peak of memory allocated during the job is measured with tracemalloc (it includes the allocations of the
+    jobs running concurrently in the same process).
+    """
+    logger.info(f'Archiving user "{username}"')
+    path_file_profile = None
+    if path_dir_profiles is not None:
+        path_file_profile = os.path.join(path_dir_profiles, f"{username}.prof")
+    if trace_memory:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+
+    start = time.perf_counter()
+    error = ""
+    with http_client.track() as stats, metrics.track() as metrics_user:
+        try:
+            with profiling.track(path_file_profile):
+                if archiver.archive_user(
+                    username=username, html_first_page=html_first_page
+                ):
+                    status = STATUS_ARCHIVED
+                else:
+                    status = STATUS_MISSING
+        except Exception as exception:
+            logger.exception(f'Failed to archive user "{username}"')
+            status = STATUS_FAILED
+            error = repr(exception)
+    duration = time.perf_counter() - start
+    if probe is not None:
+        duration_probe, stats_probe, metrics_probe = probe
+        duration += duration_probe
+        if stats_probe is not None:
+            stats.merge(stats_probe)
+        if metrics_probe is not None:
+            metrics_user.merge(metrics_probe)
+
+    return get_result(
+        username,
+        status,
+        duration=duration,
+        stats=stats,
+        metrics_user=metrics_user,
+        memory_peak=tracemalloc.get_traced_memory()[1] if trace_memory else "",
+        error=error,
+    )
+
+
+def get_result(
+    username: str,
+    status: str,
+    duration: float = 0.0,
+    stats: HttpStats = None,
+    metrics_user: metrics.Metrics = None,
+    memory_peak: int | str = "",
+    error: str = "",
+) -> dict:
+    """Result of a user, as written in the summary and the report"""
+    stats = (stats or HttpStats()).to_dict()
+    return {
+        "username": username,
+        "status": status,
+        "duration": round(duration, 3),
+        "requests": stats["requests"],
+        "bytes": stats["bytes"],
+        "retries": stats["retries"],
+        "memory_peak": memory_peak,
+        "error": error,
+        "http": stats,
+        "metrics": (metrics_user or metrics.Metrics()).to_dict(),
+        # Limits of the worker process once the user is done
+        "limits": http_client.get_limits(),
+    }
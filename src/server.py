@@ -0,0 +1,505 @@
+""" Local archive server.
+Serve the archives directory to many clients concurrently, with one thread per connection and keep-alive
+connections. Files are sent with `sendfile` (zero-copy), text files (HTML, CSS, JS, JSON) are compressed with brotli
+(when installed) or gzip, or sent from their pre-compressed `.br` / `.gz` siblings when the archiver wrote them,
+conditional requests (ETag / Last-Modified) are answered with a 304, and single byte ranges
+are supported for large pictures.
+Users packed into a container (`<username>.zip`) are served from it, members being read from a memory map of the
+container, without extracting it, and the pictures it links from the store being sent from there.
+Posts can be searched at /search (HTML page) and /search.json, when a search index is given.
+Internal files of the archives directory are never served nor listed: the ones in dot-prefixed directories or named
+after a dot (page cache, pictures store, search index, profiles, ...), and the given hidden paths (e.g. the reports).
+"""
+
+import contextlib
+import email.utils
+import functools
+import gzip
+import html
+import io
+import json
+import os
+import urllib.parse
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from core.container import EXTENSION_CONTAINER, Container
+from core.minify import SUFFIXES_ENCODING
+from core.search_index import SearchIndex
+from core.skyblog_writer import get_page_filename
+from core.template import load_template
+from logger import logger
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CONTENT_TYPES_COMPRESSIBLE = (
+    "text/html",
+    "text/css",
+    "text/javascript",
+    "text/plain",
+    "application/javascript",
+    "application/json",
+)
+# Smaller files are not worth compressing
+MIN_SIZE_COMPRESSION = 256
+
+PATH_FILE_SEARCH_TEMPLATE = str(Path(__file__).parent.parent / "res" / "search.html")
+NB_RESULTS_PER_PAGE = 20
+MAX_RESULTS_PER_PAGE = 100
+
+
+class ArchiveServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        path_dir_archives: str,
+        host: str = "localhost",
+        port: int = 8000,
+        search_index: SearchIndex = None,
+        paths_hidden: tuple = (),
+    ):
+        super().__init__(
+            (host, port),
+            functools.partial(ArchiveRequestHandler, directory=path_dir_archives),
+        )
+        self.path_dir_archives = path_dir_archives
+        self.search_index = search_index
+        self.paths_hidden = {os.path.abspath(path) for path in paths_hidden}
+
+    def is_hidden(self, path_file: str) -> bool:
+        """Whether a path of the archives directory is internal, thus never served"""
+        path_relative = os.path.relpath(os.path.abspath(path_file), self.path_dir_archives)
+        return (
+            any(part.startswith(".") for part in Path(path_relative).parts)
+            or os.path.abspath(path_file) in self.paths_hidden
+        )
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_port}"
+
+    def get_container(self, username: str) -> Container | None:
+        """Return the container of a user, if packed"""
+        path_file = os.path.join(self.path_dir_archives, username + EXTENSION_CONTAINER)
+        try:
+            stat = os.stat(path_file)
+        except (OSError, ValueError):
+            return None
+        return open_container(path_file, stat.st_mtime_ns)
+
+
+class FileBody(object):
+    """Body of a response read from a file, sent with `sendfile` (zero-copy)"""
+
+    def __init__(self, fp):
+        self.fp = fp
+        stat = os.fstat(fp.fileno())
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.mtime_ns = stat.st_mtime_ns
+        self.etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    def open_precompressed(self, encoding: str) -> "FileBody | None":
+        """Body of the pre-compressed sibling of the file, if it exists and is up to date"""
+        fp = open_precompressed(self.fp.name, encoding, self.mtime)
+        return FileBody(fp) if fp is not None else None
+
+    def compress(self, encoding: str) -> bytes:
+        return compress(self.fp.name, self.mtime_ns, encoding)
+
+    def send(self, handler: "ArchiveRequestHandler", offset: int, count: int):
+        # Zero-copy from the file to the socket, falls back to a plain copy where unavailable
+        handler.connection.sendfile(self.fp, offset, count)
+
+    def close(self):
+        self.fp.close()
+
+
+class MemberBody(object):
+    """Body of a response read from a member of a container, written from its memory map"""
+
+    def __init__(self, container: Container, name: str):
+        self.container = container
+        self.name = name
+        offset, self.size, self.mtime = container.members[name]
+        self.etag = f'"{container.mtime_ns:x}-{offset:x}-{self.size:x}"'
+
+    def open_precompressed(self, encoding: str) -> "MemberBody | None":
+        name = self.name + SUFFIXES_ENCODING[encoding]
+        return MemberBody(self.container, name) if name in self.container else None
+
+    def compress(self, encoding: str) -> bytes:
+        return compress(
+            self.container.path_file, self.container.mtime_ns, encoding, member=self.name
+        )
+
+    def send(self, handler: "ArchiveRequestHandler", offset: int, count: int):
+        handler.wfile.write(self.container.get(self.name)[offset : offset + count])
+
+    def close(self):
+        pass
+
+
+class ArchiveRequestHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.serve(head=False)
+
+    def do_HEAD(self):
+        self.serve(head=True)
+
+    def serve(self, head: bool):
+        path_url = urllib.parse.urlsplit(self.path).path
+        if self.server.search_index is not None and path_url in ("/search", "/search.json"):
+            self.search(json_output=path_url == "/search.json", head=head)
+            return
+
+        path_file = self.translate_path(self.path)
+        if self.server.is_hidden(path_file):
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return
+
+        # Users packed into a container are served from it
+        username, _, name = urllib.parse.unquote(path_url).lstrip("/").partition("/")
+        container = self.server.get_container(username) if username else None
+        if container is not None:
+            self.serve_member(container, path_url, name, head)
+            return
+
+        if os.path.isdir(path_file):
+            if not path_url.endswith("/"):
+                # Redirect to the directory, so that relative links of its index are valid
+                self.redirect(path_url + "/")
+                return
+            if not os.path.isfile(os.path.join(path_file, "index.html")):
+                listing = self.list_directory(path_file)
+                if listing is not None and not head:
+                    self.copyfile(listing, self.wfile)
+                return
+            path_file = os.path.join(path_file, "index.html")
+        self.serve_file(path_file, self.guess_type(path_file), head)
+
+    def serve_file(self, path_file: str, content_type: str, head: bool):
+        try:
+            fp = open(path_file, "rb")
+        except (OSError, ValueError):
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return
+        with fp:
+            self.send_body(FileBody(fp), content_type, head)
+
+    def serve_member(self, container: Container, path_url: str, name: str, head: bool):
+        """Answer with a member of a container, the directories of the archive being implied by the members names"""
+        if name == "" and not path_url.endswith("/"):
+            self.redirect(path_url + "/")
+            return
+        if name == "" or name.endswith("/"):
+            name += "index.html"
+        elif name not in container and f"{name}/index.html" in container:
+            self.redirect(path_url + "/")
+            return
+        path_file_link = container.get_path_link(name)
+        if path_file_link is not None:
+            self.serve_file(path_file_link, self.guess_type(name), head)
+            return
+        if name not in container:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return
+        self.send_body(MemberBody(container, name), self.guess_type(name), head)
+
+    def list_directory(self, path: str) -> io.BytesIO | None:
+        """Listing of a directory without index, leaving out the internal files"""
+        try:
+            names = sorted(os.listdir(path), key=str.lower)
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, "No permission to list directory")
+            return None
+        title = html.escape(f"Directory listing for {urllib.parse.unquote(self.path)}", quote=False)
+        items = []
+        for name in names:
+            path_file = os.path.join(path, name)
+            if self.server.is_hidden(path_file):
+                continue
+            if os.path.isdir(path_file):
+                name += "/"
+            items.append(
+                f'<li><a href="{urllib.parse.quote(name)}">{html.escape(name, quote=False)}</a></li>'
+            )
+        content = (
+            f'<!DOCTYPE html><html lang="en"><head><meta charset="utf-8"><title>{title}</title></head>'
+            f"<body><h1>{title}</h1><hr><ul>{''.join(items)}</ul><hr></body></html>"
+        ).encode()
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        return io.BytesIO(content)
+
+    def redirect(self, location: str):
+        self.send_response(HTTPStatus.MOVED_PERMANENTLY)
+        self.send_header("Location", location)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_body(self, body: FileBody | MemberBody, content_type: str, head: bool):
+        """Answer with the content of a file or a container member, honoring conditional, compression and range
+        headers"""
+        etag = body.etag
+        encoding = None
+        if (
+            content_type.startswith(CONTENT_TYPES_COMPRESSIBLE)
+            and body.size >= MIN_SIZE_COMPRESSION
+        ):
+            encoding = get_encoding(self.headers.get("Accept-Encoding", ""))
+            if encoding is not None:
+                # Each representation has its own entity tag
+                etag = f'{etag[:-1]}-{encoding}"'
+
+        if self.is_not_modified(etag, body.mtime):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_validators(etag, body.mtime)
+            self.end_headers()
+            return
+
+        if encoding is not None:
+            body_compressed = body.open_precompressed(encoding)
+            if body_compressed is not None:
+                # Sent as is, written by the archiver next to the file
+                with contextlib.closing(body_compressed):
+                    self.send_response(HTTPStatus.OK)
+                    self.send_header("Content-Type", content_type)
+                    self.send_header("Content-Encoding", encoding)
+                    self.send_header("Content-Length", str(body_compressed.size))
+                    self.send_header("Vary", "Accept-Encoding")
+                    self.send_validators(etag, body.mtime)
+                    self.end_headers()
+                    if not head and body_compressed.size:
+                        body_compressed.send(self, 0, body_compressed.size)
+                return
+
+            content = body.compress(encoding)
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Encoding", encoding)
+            self.send_header("Content-Length", str(len(content)))
+            self.send_header("Vary", "Accept-Encoding")
+            self.send_validators(etag, body.mtime)
+            self.end_headers()
+            if not head:
+                self.wfile.write(content)
+            return
+
+        offset, count = 0, body.size
+        byte_range = self.get_range(etag, body.size)
+        if byte_range == ():
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header("Content-Range", f"bytes */{body.size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if byte_range is not None:
+            offset, end = byte_range
+            count = end - offset + 1
+            self.send_response(HTTPStatus.PARTIAL_CONTENT)
+            self.send_header("Content-Range", f"bytes {offset}-{end}/{body.size}")
+        else:
+            self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(count))
+        self.send_header("Accept-Ranges", "bytes")
+        if content_type.startswith(CONTENT_TYPES_COMPRESSIBLE):
+            self.send_header("Vary", "Accept-Encoding")
+        self.send_validators(etag, body.mtime)
+        self.end_headers()
+        if not head and count:
+            body.send(self, offset, count)
+
+    def search(self, json_output: bool, head: bool):
+        """Answer a search query: ?q=<words>[&user=<username>][&page=<n>], or with limit and offset for JSON"""
+        parameters = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        query = parameters.get("q", [""])[0]
+        username = parameters.get("user", [""])[0].strip().lower() or None
+        try:
+            page_number = max(1, int(parameters.get("page", ["1"])[0]))
+            limit = int(parameters.get("limit", [NB_RESULTS_PER_PAGE])[0])
+            limit = min(max(1, limit), MAX_RESULTS_PER_PAGE)
+            offset = int(parameters.get("offset", [(page_number - 1) * limit])[0])
+        except ValueError:
+            self.send_error(HTTPStatus.BAD_REQUEST, "Invalid search parameters")
+            return
+
+        results = self.server.search_index.search(
+            query, username=username, limit=limit + 1, offset=max(0, offset)
+        )
+        has_next = len(results) > limit
+        results = results[:limit]
+
+        if json_output:
+            body = json.dumps(
+                {"query": query, "results": results, "has_next": has_next}
+            ).encode()
+            content_type = "application/json"
+        else:
+            body = render_search_page(query, username, results, page_number, has_next)
+            content_type = "text/html; charset=utf-8"
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def send_validators(self, etag: str, mtime: float):
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", self.date_time_string(int(mtime)))
+        self.send_header("Cache-Control", "no-cache")
+
+    def is_not_modified(self, etag: str, mtime: float) -> bool:
+        if "If-None-Match" in self.headers:
+            # If-Modified-Since is ignored when If-None-Match is given
+            etags = [
+                value.strip().removeprefix("W/")
+                for value in self.headers["If-None-Match"].split(",")
+            ]
+            return "*" in etags or etag in etags
+        if "If-Modified-Since" in self.headers:
+            try:
+                since = email.utils.parsedate_to_datetime(self.headers["If-Modified-Since"])
+            except (TypeError, ValueError):
+                return False
+            return since is not None and int(mtime) <= since.timestamp()
+        return False
+
+    def get_range(self, etag: str, size: int) -> tuple[int, int] | tuple | None:
+        """Parse the Range header. Return the (first, last) byte positions of a satisfiable single range, an empty
+        tuple if it is not satisfiable, or None to send the whole file"""
+        value = self.headers.get("Range")
+        if value is None or not value.startswith("bytes="):
+            return None
+        if_range = self.headers.get("If-Range")
+        if if_range is not None and if_range.strip() != etag:
+            # The file changed since the client got its first part
+            return None
+        ranges = value[len("bytes=") :].split(",")
+        if len(ranges) != 1:
+            # Multiple ranges are rare, the whole file is sent instead
+            return None
+
+        first, _, last = ranges[0].strip().partition("-")
+        try:
+            if not first:
+                # Suffix range, the last bytes of the file
+                length = int(last)
+                if length <= 0 or size == 0:
+                    return ()
+                return max(0, size - length), size - 1
+            first = int(first)
+            last = int(last) if last else size - 1
+        except ValueError:
+            return None
+        if first >= size or last < first:
+            return ()
+        return first, min(last, size - 1)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+def render_search_page(
+    query: str, username: str | None, results: list[dict], page_number: int, has_next: bool
+) -> bytes:
+    results_html = []
+    for result in results:
+        url_post = (
+            f"/{urllib.parse.quote(result['username'])}/{get_page_filename(result['page'])}"
+            f"#{urllib.parse.quote(result['id'])}"
+        )
+        results_html.append(
+            f'<div class="result"><a href="{html.escape(url_post)}">'
+            f"{html.escape(result['title'] or result['username'])}</a> "
+            f'<span class="date">{html.escape(result["username"])} - {html.escape(result["date"])}</span>'
+            f"<p>{result['snippet']}</p></div>"
+        )
+    if query and not results:
+        results_html.append("<p>No post found.</p>")
+
+    # Previous and next pages of results
+    pagination = ""
+    if page_number > 1 or has_next:
+        parameters = {"q": query}
+        if username is not None:
+            parameters["user"] = username
+        links = []
+        if page_number > 1:
+            url = "/search?" + urllib.parse.urlencode({**parameters, "page": page_number - 1})
+            links.append(f'<a href="{html.escape(url)}">&laquo; Previous</a>')
+        if has_next:
+            url = "/search?" + urllib.parse.urlencode({**parameters, "page": page_number + 1})
+            links.append(f'<a href="{html.escape(url)}">Next &raquo;</a>')
+        pagination = f'<nav class="pagination">{" ".join(links)}</nav>'
+
+    fp = io.StringIO()
+    load_template(PATH_FILE_SEARCH_TEMPLATE).render(
+        fp,
+        {
+            "query": html.escape(query),
+            "username": html.escape(username or ""),
+            "results": results_html,
+            "pagination": pagination,
+        },
+    )
+    return fp.getvalue().encode()
+
+
+def get_encoding(accept_encoding: str) -> str | None:
+    """Pick the best content coding accepted by the client"""
+    accepted = set()
+    for value in accept_encoding.split(","):
+        coding, _, parameters = value.strip().partition(";")
+        if parameters.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(coding.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def open_precompressed(path_file: str, encoding: str, mtime: float):
+    """Open the pre-compressed sibling of a file, if it exists and is up to date"""
+    try:
+        fp = open(path_file + SUFFIXES_ENCODING[encoding], "rb")
+    except OSError:
+        return None
+    if os.fstat(fp.fileno()).st_mtime < mtime:
+        fp.close()
+        return None
+    return fp
+
+
+@functools.lru_cache(maxsize=64)
+def open_container(path_file: str, mtime_ns: int) -> Container:
+    """Open a container once per modification, its map being shared by all the requests"""
+    return Container(path_file)
+
+
+@functools.lru_cache(maxsize=256)
+def compress(path_file: str, mtime_ns: int, encoding: str, member: str = None) -> bytes:
+    """Compress a file (or a member of a container file) once per modification"""
+    if member is None:
+        with open(path_file, "rb") as fp:
+            content = fp.read()
+    else:
+        content = bytes(open_container(path_file, mtime_ns).get(member))
+    if encoding == "br":
+        return brotli.compress(content, mode=brotli.MODE_TEXT)
+    return gzip.compress(content, compresslevel=6, mtime=0)
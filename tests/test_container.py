@@ -0,0 +1,68 @@
+import os
+import zipfile
+
+from core.container import FILENAME_LINKS, Container, pack_directory
+
+
+def test_members_offsets(tmp_path):
+    path_file = str(tmp_path / "user.zip")
+    members = {
+        "index.html": b"<p>index</p>",
+        "images/été.jpg": os.urandom(100),
+        "a" * 200 + ".css": b"body{}",
+        "empty.txt": b"",
+    }
+    with zipfile.ZipFile(path_file, "w", compression=zipfile.ZIP_STORED) as container:
+        for i, (name, data) in enumerate(members.items()):
+            info = zipfile.ZipInfo(name, date_time=(2020, 1, 1, 0, 0, 0))
+            # Extra fields of various lengths
+            info.extra = b"\xfe\xca" + i.to_bytes(2, "little") + b"x" * i
+            container.writestr(info, data)
+
+    container = Container(path_file)
+    assert set(container.members) == set(members)
+    for name, data in members.items():
+        assert bytes(container.get(name)) == data
+
+
+def test_local_header_differs_from_central_directory(tmp_path):
+    path_file = str(tmp_path / "user.zip")
+    with zipfile.ZipFile(path_file, "w", compression=zipfile.ZIP_STORED) as container:
+        for name in ("first.html", "second.html"):
+            info = zipfile.ZipInfo(name, date_time=(2020, 1, 1, 0, 0, 0))
+            info.extra = b"\xfe\xca\x08\x00" + b"x" * 8
+            container.writestr(info, name.encode())
+            # Only written to the local header, the central directory is written on close
+            info.extra = b""
+
+    with zipfile.ZipFile(path_file) as container:
+        assert all(info.extra == b"" for info in container.infolist())
+    container = Container(path_file)
+    assert bytes(container.get("first.html")) == b"first.html"
+    assert bytes(container.get("second.html")) == b"second.html"
+
+
+def test_pack_directory(tmp_path):
+    path_dir = tmp_path / "user"
+    (path_dir / "images").mkdir(parents=True)
+    (path_dir / "index.html").write_bytes(b"<p>index</p>")
+    (path_dir / "manifest.json").write_bytes(b"{}")
+    (path_dir / "images" / "1.jpg").write_bytes(b"picture")
+    path_file = str(tmp_path / "user.zip")
+
+    pack_directory(
+        str(path_dir),
+        path_file,
+        filenames_kept=("manifest.json",),
+        links={"images/1.jpg": ".store/objects/ab/ab"},
+    )
+    assert sorted(os.listdir(path_dir)) == ["manifest.json"]
+
+    container = Container(path_file)
+    assert set(container.members) == {"index.html"}
+    assert FILENAME_LINKS not in container
+    assert bytes(container.get("index.html")) == b"<p>index</p>"
+    assert container.get_path_link("images/1.jpg") == os.path.join(
+        str(tmp_path), ".store/objects/ab/ab"
+    )
+    assert container.get_path_link("index.html") is None
@@ -0,0 +1,76 @@
+import json
+import os
+
+from core.manifest import Manifest
+from core.post import Post
+
+
+def make_posts(*ids: str) -> list[Post]:
+    return [
+        Post(text=f"<p>{id}</p>", image=None, date="date", title=id, id=id)
+        for id in ids
+    ]
+
+
+def test_journal_replay(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    manifest.add_page(1, make_posts("a-1", "a-2"))
+    manifest.add_page(2, make_posts("a-3"))
+    manifest.add_asset("https://i.skyrock.net/1.jpg", str(tmp_path / "images" / "1.jpg"), "ab")
+    # Nothing but the journal is written until the metadata is set or the archive complete
+    assert not os.path.exists(manifest.path_file)
+
+    manifest = Manifest(str(tmp_path))
+    assert manifest.pages == {"1": ["a-1", "a-2"], "2": ["a-3"]}
+    assert manifest.assets == {
+        os.path.join("images", "1.jpg"): {"url": "https://i.skyrock.net/1.jpg", "sha256": "ab"}
+    }
+    assert manifest.has_page(1) and manifest.has_page(2) and not manifest.has_page(3)
+    assert [post.title for post in manifest.get_page_posts(1)] == ["a-1", "a-2"]
+
+
+def test_journal_compacted_on_completion(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    manifest.add_page(1, make_posts("a-1"))
+    assert not Manifest.is_complete(str(tmp_path))
+    manifest.set_complete(True)
+    assert not os.path.exists(manifest.path_file_journal)
+    assert Manifest.is_complete(str(tmp_path))
+
+    manifest = Manifest(str(tmp_path))
+    assert manifest.complete
+    assert manifest.pages == {"1": ["a-1"]}
+
+
+def test_truncated_journal(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    manifest.add_page(1, make_posts("a-1"))
+    size = os.path.getsize(manifest.path_file_journal)
+    # Interrupted while recording the second page
+    with open(manifest.path_file_journal, "ab") as fp:
+        fp.write(json.dumps({"page": 2, "posts": ["a-2"]}).encode()[:10])
+
+    manifest = Manifest(str(tmp_path))
+    assert manifest.pages == {"1": ["a-1"]}
+    assert os.path.getsize(manifest.path_file_journal) == size
+
+    # Changes recorded afterwards are not glued to the truncated line
+    manifest.add_page(2, make_posts("a-2"))
+    manifest = Manifest(str(tmp_path))
+    assert manifest.pages == {"1": ["a-1"], "2": ["a-2"]}
+    assert [post.title for post in manifest.get_page_posts(2)] == ["a-2"]
+
+
+def test_truncated_posts(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    manifest.add_page(1, make_posts("a-1", "a-2"))
+    # Interrupted while writing the last post of the page
+    with open(manifest.path_file_posts, "r+b") as fp:
+        fp.truncate(os.path.getsize(manifest.path_file_posts) - 5)
+
+    manifest = Manifest(str(tmp_path))
+    assert not manifest.has_page(1)
+    manifest.add_page(1, make_posts("a-1", "a-2"))
+    manifest = Manifest(str(tmp_path))
+    assert manifest.has_page(1)
+    assert [post.title for post in manifest.get_page_posts(1)] == ["a-1", "a-2"]
@@ -0,0 +1,67 @@
+import types
+
+import pytest
+
+from server import ArchiveRequestHandler
+
+ETAG = '"etag"'
+
+
+def get_range(size: int, range: str | None, if_range: str = None):
+    headers = {}
+    if range is not None:
+        headers["Range"] = range
+    if if_range is not None:
+        headers["If-Range"] = if_range
+    handler = types.SimpleNamespace(headers=headers)
+    return ArchiveRequestHandler.get_range(handler, ETAG, size)
+
+
+@pytest.mark.parametrize(
+    "range, expected",
+    [
+        ("bytes=0-99", (0, 99)),
+        ("bytes=10-19", (10, 19)),
+        # Open and oversized ranges end at the last byte
+        ("bytes=10-", (10, 99)),
+        ("bytes=90-200", (90, 99)),
+        # Suffix ranges
+        ("bytes=-10", (90, 99)),
+        ("bytes=-200", (0, 99)),
+    ],
+)
+def test_satisfiable(range, expected):
+    assert get_range(100, range) == expected
+
+
+@pytest.mark.parametrize(
+    "range", ["bytes=100-", "bytes=100-200", "bytes=20-10", "bytes=-0"]
+)
+def test_not_satisfiable(range):
+    assert get_range(100, range) == ()
+
+
+def test_empty_file():
+    assert get_range(0, "bytes=0-") == ()
+    assert get_range(0, "bytes=-10") == ()
+
+
+@pytest.mark.parametrize(
+    "range",
+    [
+        None,
+        "items=0-10",
+        "bytes=a-b",
+        "bytes=-",
+        # Multiple ranges are sent as the whole file
+        "bytes=0-10,20-30",
+    ],
+)
+def test_whole_file(range):
+    assert get_range(100, range) is None
+
+
+def test_if_range():
+    assert get_range(100, "bytes=0-9", if_range=ETAG) == (0, 9)
+    # The file changed since the first part was sent
+    assert get_range(100, "bytes=0-9", if_range='"other"') is None